@@ -4,11 +4,14 @@
 
 """Models multi armed bandit arms as distributions"""
 
-from analytics.bandit.draw_log_normal import draw_log_normal_means
-from analytics.bandit.draw_mus_and_sigmas import draw_mus_and_sigmas
+from analytics.bandit.draw_log_normal import draw_log_normal_means_from_stats
+from analytics.bandit.draw_mus_and_sigmas import draw_mus_and_sigmas_from_stats
+from analytics.bandit.arm_stats import summarize, moments, log_moments, N, N_POS, SUM, \
+    STATS_SIZE
+from analytics.bandit.cholesky import cholesky_update, cholesky_solve, solve_triangular
 from numpy.random import beta as beta_dist
-from numpy import count_nonzero
-import time
+import logging
+import numpy as np
 
 
 class Arm(object):
@@ -19,6 +22,18 @@ class Arm(object):
         """Abstract method to sample from an arm"""
         raise NotImplementedError
 
+    def sample_stats(self, stats, n):
+        """Abstract method to sample from an arm given the sufficient statistics of its rewards"""
+        raise NotImplementedError
+
+    def summarize(self, data):
+        """Returns the sufficient statistics of rewards used by sample_stats"""
+        return summarize(data)
+
+    def subset(self, indexes):
+        """Returns the model of only the arms at indexes, the same model unless arms differ"""
+        return self
+
 
 class LogNormalArm(Arm):
     """A log normal distribution for rewards
@@ -42,7 +57,24 @@ class LogNormalArm(Arm):
 
         if data is None:
             data = self.data
-        return draw_log_normal_means(data, self.m0, self.k0, self.s_sq0, self.v0, n)
+        return self.sample_stats(self.summarize(data), n)
+
+    def summarize(self, data):
+        """Returns the sufficient statistics of rewards, warning that rewards that are not positive
+        are left out of the log moments"""
+        stats = summarize(data)
+        if stats[N_POS] < stats[N]:
+            logging.warning('{} rewards that are not positive are left out of a log normal arm, '
+                            'use ZeroInflatedLogNormalArm for rewards with zeros'.format(
+                                int(stats[N] - stats[N_POS])))
+        return stats
+
+    def sample_stats(self, stats, n=1):
+        """Return n samples from distribution given the sufficient statistics of the rewards"""
+
+        n_log, log_mean, log_ssd = log_moments(stats)
+        return draw_log_normal_means_from_stats(n_log, log_mean, log_ssd, self.m0, self.k0,
+                                                self.s_sq0, self.v0, n)
 
 
 class NormalArm(Arm):
@@ -67,10 +99,14 @@ class NormalArm(Arm):
 
         if data is None:
             data = self.data
-        sample_normal_start = time.time()
-        mu_samples, __ = draw_mus_and_sigmas(data, self.m0, self.k0, self.s_sq0, self.v0, n)
-        sample_normal_end = time.time()
-        print 'sample normal: {}'.format(sample_normal_end - sample_normal_start)
+        return self.sample_stats(self.summarize(data), n)
+
+    def sample_stats(self, stats, n=1):
+        """Return n samples from distribution given the sufficient statistics of the rewards"""
+
+        total, the_mean, ssd = moments(stats)
+        mu_samples, __ = draw_mus_and_sigmas_from_stats(total, the_mean, ssd, self.m0, self.k0,
+                                                        self.s_sq0, self.v0, n)
         return mu_samples
 
 
@@ -90,11 +126,160 @@ class BinomialArm(Arm):
 
         if data is None:
             data = self.data
+        return self.sample_stats(self.summarize(data), n)
 
-        successes = count_nonzero(data)
-        total = len(data)
+    def sample_stats(self, stats, n=1):
+        """Return n samples from distribution given the sufficient statistics of the rewards"""
+
+        successes = stats[N_POS]
+        total = stats[N]
         samples = beta_dist(self.alpha + successes, self.beta + total - successes, n)
         return samples
 
 
+class ZeroInflatedLogNormalArm(Arm):
+    """A beta rate of non-zero rewards times log normal non-zero rewards, such as revenue per user
+    alpha, beta - Beta prior on the rate of non-zero rewards.
+    m0, k0, s_sq0, v0 - Prior on the log of the non-zero rewards, same as LogNormalArm."""
+    NAME = "zero_inflated_lognormal"
+
+    def __init__(self, data=None, alpha=1, beta=1, m0=1., k0=1., s_sq0=1., v0=1.):
+        self.alpha = alpha
+        self.beta = beta
+        self.m0 = float(m0)
+        self.k0 = float(k0)
+        self.s_sq0 = float(s_sq0)
+        self.v0 = float(v0)
+        if data is None:
+            data = []
+        self.data = data
+
+    def sample(self, data=None, n=1):
+        """Return n samples from distribution"""
+
+        if data is None:
+            data = self.data
+        return self.sample_stats(self.summarize(data), n)
+
+    def sample_stats(self, stats, n=1):
+        """Return n samples from distribution given the sufficient statistics of the rewards"""
+
+        total = stats[N]
+        non_zeros = stats[N_POS]
+        rate_samples = beta_dist(self.alpha + non_zeros, self.beta + total - non_zeros, n)
+        n_log, log_mean, log_ssd = log_moments(stats)
+        value_samples = draw_log_normal_means_from_stats(n_log, log_mean, log_ssd, self.m0,
+                                                         self.k0, self.s_sq0, self.v0, n)
+        return rate_samples * value_samples
+
+
+class PoissonBootstrapArm(Arm):
+    """Online Poisson bootstrap arm for heavy tailed metrics like cumarpu
+    replicates - Number of bootstrap replicates B.
+    prior_mean - Mean of the pseudo rewards added to every replicate.
+    prior_weight - Weight of the pseudo rewards, which keeps replicates defined before any data.
+    chunk_size - Number of rewards weighted at once, bounding memory to chunk_size * B weights."""
+    NAME = "bootstrap"
+
+    def __init__(self, replicates=200, prior_mean=0., prior_weight=1., chunk_size=5000):
+        self.replicates = replicates
+        self.prior_mean = prior_mean
+        self.prior_weight = prior_weight
+        self.chunk_size = chunk_size
+
+    def summarize(self, data):
+        """Returns the moments of the rewards followed by the Poisson weights and weighted sums of
+        every replicate"""
+        values = np.asarray(data if data is not None else [], dtype=float)
+        weights = np.zeros(self.replicates)
+        sums = np.zeros(self.replicates)
+        for start in xrange(0, values.size, self.chunk_size):
+            chunk = values[start:start + self.chunk_size]
+            chunk_weights = np.random.poisson(1, (chunk.size, self.replicates))
+            weights += chunk_weights.sum(axis=0)
+            sums += np.dot(chunk, chunk_weights)
+        return np.concatenate([summarize(values), weights, sums])
+
+    def sample(self, data=None, n=1):
+        """Returns the means of n replicates picked at random, or the prior mean without data"""
+        if data is None or len(data) == 0:
+            return np.repeat(float(self.prior_mean), n)
+        return self.sample_stats(self.summarize(data), n)
+
+    def sample_stats(self, stats, n):
+        """Returns the means of n replicates picked at random"""
+        weights = stats[STATS_SIZE:STATS_SIZE + self.replicates]
+        sums = stats[STATS_SIZE + self.replicates:]
+        means = (sums + self.prior_weight * self.prior_mean) / (weights + self.prior_weight)
+        return means[np.random.randint(self.replicates, size=n)]
+
+
+class LinearArm(Arm):
+    """A bayesian linear regression of rewards on features of the arms. The Cholesky factor of the
+    posterior precision is built from the sufficient statistics of the arms with one rank one
+    update per arm, so the arm itself keeps no posterior state.
+    features - k by d array of the features of each arm.
+    prior_precision - Precision of the normal prior on each weight.
+    noise_variance - Variance of the rewards around their mean.
+    arm_effects - Adds an indicator feature per arm, so each arm also gets its own intercept."""
+    NAME = "linear"
+
+    def __init__(self, features, prior_precision=1., noise_variance=1., arm_effects=False):
+        self.base_features = np.atleast_2d(np.asarray(features, dtype=float))
+        self.prior_precision = float(prior_precision)
+        self.noise_variance = float(noise_variance)
+        self.arm_effects = arm_effects
+
+    def get_features(self):
+        """Returns the k by d feature matrix, including the arm indicators if used"""
+        if self.arm_effects:
+            return np.hstack([self.base_features, np.eye(len(self.base_features))])
+        return self.base_features
+
+    def add_features(self, features):
+        """Adds the features of a new arm"""
+        features = np.asarray(features, dtype=float)
+        if features.shape != (self.base_features.shape[1],):
+            raise RuntimeError('Expected a row of {} features but got shape {}'.format(
+                self.base_features.shape[1], features.shape))
+        self.base_features = np.vstack([self.base_features, features])
+
+    def subset(self, indexes):
+        """Returns a LinearArm of only the arms at indexes, keeping their feature rows"""
+        return LinearArm(self.get_features()[indexes], self.prior_precision, self.noise_variance)
+
+    def get_posterior(self, stats):
+        """Returns the Cholesky factor of the posterior precision of the weights and their posterior
+        mean from a k by s array of the sufficient statistics of each arm"""
+        features = self.get_features()
+        if len(stats) != len(features):
+            raise RuntimeError('Got statistics for {} arms but features for {} arms'.format(
+                len(stats), len(features)))
+        cholesky = np.eye(features.shape[1]) * np.sqrt(self.prior_precision)
+        for i in np.flatnonzero(stats[:, N]):
+            cholesky = cholesky_update(cholesky,
+                                       features[i] * np.sqrt(stats[i, N] / self.noise_variance))
+        target = np.dot(stats[:, SUM], features) / self.noise_variance
+        return cholesky, cholesky_solve(cholesky, target)
+
+    def sample_means(self, stats, n=1):
+        """Returns a k by n array of samples of every arm's mean reward from the posterior given a
+        k by s array of the sufficient statistics of each arm"""
+        cholesky, mean = self.get_posterior(stats)
+        noise = np.random.normal(size=(len(mean), n))
+        weights = mean[:, None] + solve_triangular(cholesky, noise, lower=True, trans='T')
+        return np.dot(self.get_features(), weights)
+
+    def sample(self, data=None, n=1):
+        """Return n samples of the mean of one arm's rewards"""
+        return self.sample_stats(self.summarize([] if data is None else data), n)
+
+    def sample_stats(self, stats, n=1):
+        """Return n samples of the mean of one arm from its own rewards alone, as a regression on
+        an indicator of the arm, for comparisons that sample the arms one at a time"""
+        precision = self.prior_precision + stats[N] / self.noise_variance
+        return np.random.normal(stats[SUM] / self.noise_variance / precision,
+                                1. / np.sqrt(precision), n)
+
+
 ALL_BANDIT_ARMS = {x.NAME: x for x in Arm.__subclasses__()}
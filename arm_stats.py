@@ -0,0 +1,223 @@
+"""Sufficient statistics of the rewards observed by an arm"""
+
+import numpy as np
+from datetime import timedelta
+from multiprocessing import Pool
+from analytics.bandit.sketch import QuantileSketch
+
+# layout of the statistics vector
+N, N_POS, SUM, SUM_SQ, LOG_SUM, LOG_SUM_SQ = range(6)
+STATS_SIZE = 6
+
+
+def summarize(data):
+    """Reduces raw rewards to a vector of sufficient statistics: the number of rewards, the number
+    of positive rewards, the sum and sum of squares of the rewards, and the sum and sum of squares
+    of the log of the positive rewards. Vectors from disjoint sets of rewards can be added."""
+    values = np.asarray(data, dtype=float)
+    log_values = np.log(values[values > 0])
+    return np.array([values.size, log_values.size, values.sum(), np.dot(values, values),
+                     log_values.sum(), np.dot(log_values, log_values)])
+
+
+def empty_stats():
+    """Returns the statistics of an arm with no rewards"""
+    return np.zeros(STATS_SIZE)
+
+
+def moments(stats):
+    """Returns the count, mean and sum of squared differences from the mean of the rewards"""
+    n = stats[N]
+    mean = stats[SUM] / n if n > 0 else 0.
+    return n, mean, max(stats[SUM_SQ] - n * mean ** 2, 0.)
+
+
+def log_moments(stats):
+    """Returns the count, mean and sum of squared differences from the mean of the log of the
+    positive rewards"""
+    n = stats[N_POS]
+    mean = stats[LOG_SUM] / n if n > 0 else 0.
+    return n, mean, max(stats[LOG_SUM_SQ] - n * mean ** 2, 0.)
+
+
+def summarize_by_day(data, summarize=summarize):
+    """Returns a list of (day, statistics) pairs in date order for the rewards in a series indexed
+    by the date they were collected
+    summarize - Function reducing rewards to the statistics of the arm model."""
+    if data is None or len(data) == 0:
+        return []
+
+    values = np.asarray(data)
+    days, day_index = np.unique(np.asarray(data.index), return_inverse=True)
+    order = np.argsort(day_index, kind='mergesort')
+    splits = np.cumsum(np.bincount(day_index, minlength=len(days)))[:-1]
+    return [(day, summarize(day_values))
+            for day, day_values in zip(days, np.split(values[order], splits))]
+
+
+class ArmState(object):
+    """Sufficient statistics of the rewards of one arm bucketed by the date they were collected
+    empty - Statistics of no rewards for the arm model, which fixes the size of the vectors.
+    half_life - If set, no buckets are kept and the statistics are discounted by half every
+    half_life cycles instead."""
+
+    def __init__(self, empty=None, half_life=None):
+        self.empty = empty_stats() if empty is None else empty
+        self.half_life = half_life
+        self.buckets = {}
+        self.stats = self.empty
+        self.current = self.empty
+        self.max_date = None
+
+    def __len__(self):
+        return int(round(self.stats[N]))
+
+    def add(self, day, stats):
+        """Adds the statistics of rewards collected on day"""
+        if self.half_life is None:
+            self.buckets[day] = self.buckets.get(day, self.empty) + stats
+        self.stats = self.stats + stats
+        self.current = self.current + stats
+        self.max_date = day if self.max_date is None else max(self.max_date, day)
+        return self
+
+    def decay(self, cycles=1):
+        """Discounts the statistics by the given number of cycles of the half life"""
+        if self.half_life is not None:
+            self.current = self.current * 0.5 ** (float(cycles) / self.half_life)
+        return self
+
+    def truncate(self, start_date, stats=None):
+        """Drops the rewards collected before start_date from the statistics the policy sees.
+        Discounted states keep no buckets, so they are reset to stats, the statistics of the
+        rewards since start_date."""
+        if self.half_life is None:
+            self.buckets = {day: day_stats for day, day_stats in self.buckets.iteritems()
+                            if day >= start_date}
+            self.current = sum(self.buckets.itervalues(), self.empty)
+        else:
+            self.current = self.empty if stats is None else stats
+        return self
+
+    def merge(self, other):
+        """Adds the statistics of another state built from a disjoint set of rewards. Merging is
+        associative and commutative, so partitions of the rewards can be summarized separately and
+        combined exactly. Discounted states must have been decayed to the same cycle."""
+        for day, day_stats in other.buckets.iteritems():
+            self.buckets[day] = self.buckets.get(day, self.empty) + day_stats
+        self.stats = self.stats + other.stats
+        self.current = self.current + other.current
+        if other.max_date is not None:
+            self.max_date = other.max_date if self.max_date is None else max(self.max_date,
+                                                                             other.max_date)
+        return self
+
+    def update(self, data, summarize=summarize):
+        """Adds the rewards in a series indexed by the date they were collected
+        summarize - Function reducing rewards to the statistics of the arm model."""
+        for day, stats in summarize_by_day(data, summarize):
+            self.add(day, stats)
+        return self
+
+    def get_stats(self, run_date=None, sliding_window=None):
+        """Returns the statistics of the rewards collected within sliding_window days of run_date,
+        or of all rewards since the last change point if sliding_window is None. Discounted states
+        return the discounted statistics regardless of the window."""
+        if self.half_life is not None or sliding_window is None:
+            return self.current
+
+        start_date = run_date - timedelta(days=sliding_window)
+        stats = self.empty
+        for day, day_stats in self.buckets.iteritems():
+            if day >= start_date:
+                stats = stats + day_stats
+        return stats
+
+    def get_max_date(self):
+        """Returns the last date rewards were collected"""
+        return self.max_date
+
+
+def merge_arm_states(states, other_states):
+    """Merges a dictionary of arm name to ArmState into another one and returns it"""
+    for name, state in other_states.iteritems():
+        if name in states:
+            states[name].merge(state)
+        else:
+            states[name] = state
+    return states
+
+
+def merge_day_sketches(sketches, other_sketches):
+    """Merges a dictionary of arm name to a dictionary of day to QuantileSketch into another one
+    and returns it"""
+    for name, day_sketches in other_sketches.iteritems():
+        arm_sketches = sketches.setdefault(name, {})
+        for day, sketch in day_sketches.iteritems():
+            if day in arm_sketches:
+                arm_sketches[day].merge(sketch)
+            else:
+                arm_sketches[day] = sketch
+    return sketches
+
+
+def summarize_partition(partition, arm, half_life=None, arm_column='shard', date_column='date',
+                        value_column='value', sketch_size=None):
+    """Returns a dictionary of arm name to ArmState for a dataframe of rewards with columns for the
+    arm, the date collected and the value. partition may also be a function loading the dataframe,
+    so worker processes can load their own partition.
+    sketch_size - Also returns a dictionary of arm name to a dictionary of day to a QuantileSketch
+    of this size of the day's rewards."""
+    if callable(partition):
+        partition = partition()
+
+    states = {}
+    sketches = {}
+    for name, arm_df in partition.groupby(arm_column):
+        data = arm_df[value_column]
+        data.index = arm_df[date_column]
+        states[name] = ArmState(arm.summarize([]), half_life).update(data, arm.summarize)
+        if sketch_size is not None:
+            sketches[name] = {day: QuantileSketch(sketch_size).update(values)
+                              for day, values in summarize_by_day(data, np.asarray)}
+    return states if sketch_size is None else (states, sketches)
+
+
+def _summarize_partition_job(args):
+    """Unpacks arguments for summarize_partition in a worker process"""
+    return summarize_partition(*args)
+
+
+def reduce_partitions(partitions, arm, half_life=None, arm_column='shard', date_column='date',
+                      value_column='value', processes=None, sketch_size=None):
+    """Summarizes partitions of rewards in worker processes into one dictionary of arm name to
+    ArmState
+    partitions - Dataframes or functions loading dataframes, see summarize_partition.
+    processes - Number of worker processes, defaulting to the number of cores. Runs in process if
+    1.
+    sketch_size - Also returns the merged daily quantile sketches of each arm, see
+    summarize_partition."""
+    jobs = [(partition, arm, half_life, arm_column, date_column, value_column, sketch_size)
+            for partition in partitions]
+    states = {}
+    sketches = {}
+
+    def merge(result):
+        if sketch_size is None:
+            merge_arm_states(states, result)
+        else:
+            merge_arm_states(states, result[0])
+            merge_day_sketches(sketches, result[1])
+
+    if processes == 1:
+        for job in jobs:
+            merge(_summarize_partition_job(job))
+    else:
+        pool = Pool(processes)
+        try:
+            for result in pool.imap_unordered(_summarize_partition_job, jobs):
+                merge(result)
+        finally:
+            pool.close()
+            pool.join()
+    return states if sketch_size is None else (states, sketches)
@@ -0,0 +1,77 @@
+"""
+Tests sufficient statistics of arm rewards
+"""
+from analytics.bandit.arm import NormalArm
+from analytics.bandit.arm_stats import ArmState, summarize, moments, log_moments, \
+    reduce_partitions, N
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+
+START_DATE = date(2017, 4, 1)
+
+
+def new_rewards(days=10, n=100, seed=0):
+    random = np.random.RandomState(seed)
+    return pd.Series(random.lognormal(size=days * n),
+                     index=np.repeat([START_DATE + timedelta(days=d) for d in xrange(days)], n))
+
+
+def test_moments():
+    values = np.concatenate([np.random.lognormal(size=1000), np.zeros(100)])
+    n, mean, ssd = moments(summarize(values))
+    assert n == 1100 and np.isclose(mean, values.mean())
+    assert np.isclose(ssd, ((values - values.mean()) ** 2).sum())
+    n_log, log_mean, log_ssd = log_moments(summarize(values))
+    assert n_log == 1000 and np.isclose(log_mean, np.log(values[values > 0]).mean())
+
+
+def test_sliding_window():
+    data = new_rewards()
+    state = ArmState().update(data)
+    run_date = START_DATE + timedelta(days=10)
+    window = data[data.index >= run_date - timedelta(days=3)]
+    assert np.allclose(state.get_stats(run_date, 3), summarize(window))
+    assert np.allclose(state.get_stats(run_date), summarize(data))
+
+
+def test_truncate():
+    data = new_rewards()
+    change_date = START_DATE + timedelta(days=6)
+    state = ArmState().update(data).truncate(change_date)
+    assert np.allclose(state.current, summarize(data[data.index >= change_date]))
+    assert np.allclose(state.stats, summarize(data))
+
+
+def test_decay():
+    state = ArmState(half_life=2)
+    state.add(START_DATE, summarize(np.ones(100)))
+    state.decay(4)
+    assert np.isclose(state.current[N], 25) and state.stats[N] == 100
+
+
+def test_merge():
+    data = new_rewards()
+    parts = [ArmState().update(data.iloc[i::3]) for i in xrange(3)]
+    merged = parts[0].merge(parts[1]).merge(parts[2])
+    whole = ArmState().update(data)
+    assert np.allclose(merged.stats, whole.stats)
+    assert sorted(merged.buckets) == sorted(whole.buckets)
+    assert merged.get_max_date() == whole.get_max_date()
+
+
+def test_reduce_partitions():
+    data = new_rewards()
+    logs = pd.DataFrame(dict(shard=np.tile(['a', 'b'], len(data) // 2), date=data.index,
+                             value=data.values))
+    states = reduce_partitions([logs.iloc[:300], logs.iloc[300:]], NormalArm(), processes=1)
+    assert sorted(states) == ['a', 'b']
+    assert np.allclose(states['a'].stats, summarize(logs.value[logs.shard == 'a']))
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
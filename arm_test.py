@@ -0,0 +1,111 @@
+"""
+Tests the posterior models of the bandit arms
+"""
+from analytics.bandit.arm import LinearArm, LogNormalArm, PoissonBootstrapArm, \
+    ZeroInflatedLogNormalArm
+from analytics.bandit.arm_stats import N, N_POS, SUM, summarize
+from analytics.bandit.bandit import BayesianBandit, LinearThompsonBandit
+from analytics.bandit.environment import Environment, Scenario
+from datetime import date
+import logging
+import numpy as np
+
+
+def test_bootstrap_without_data():
+    arm = PoissonBootstrapArm(prior_mean=2.)
+    for data in (None, []):
+        assert (arm.sample(data, 5) == 2.).all()
+        assert (arm.sample_stats(arm.summarize(data), 5) == 2.).all()
+    samples = arm.sample(np.random.exponential(10., 1000), 100)
+    assert np.isfinite(samples).all() and abs(samples.mean() - 10.) < 1.5
+
+
+def test_log_normal_warns_on_zeros():
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logging.getLogger().addHandler(handler)
+    try:
+        stats = LogNormalArm().summarize([0., 1., 2.])
+        LogNormalArm().summarize([1., 2.])
+    finally:
+        logging.getLogger().removeHandler(handler)
+    assert stats[N] == 3 and stats[N_POS] == 2
+    assert len(records) == 1
+
+
+def test_zero_inflated_arms_share_no_state():
+    scenario = Scenario('zero_inflated_lognormal', mus=[0., 2.], sigmas=[.5, .5], ps=[.3, .3])
+    env = Environment(2, BayesianBandit(), ZeroInflatedLogNormalArm(), start_date=date(2017, 4, 1),
+                      batch=1000, test_vars=dict(scenario=scenario))
+    env.run_cycle(incremental=True)
+    assert not hasattr(env.arm, 'stats')
+    means = [env.arm.sample_stats(state.stats, 2000).mean() for state in env.arm_states]
+    assert means[1] > 2 * means[0]
+
+
+def new_linear_environment(k=3):
+    features = np.column_stack([np.ones(k), np.arange(k)])
+    return Environment(k, LinearThompsonBandit(), LinearArm(features, noise_variance=25.),
+                       start_date=date(2017, 4, 1), batch=300,
+                       test_vars=dict(scenario=Scenario('normal', mus=[10., 12., 14., 16.],
+                                                        sigmas=[5.] * 4)))
+
+
+def test_linear_add_arm():
+    env = new_linear_environment()
+    env.run_cycle(incremental=True)
+    env.add_arm(name='3', features=[1., 3.])
+    env.run_cycle(incremental=True)
+    assert len(env.arm.get_features()) == env.k == 4
+    assert env.get_allocation(sort=False, names=False).index.max() < 4
+
+
+def test_linear_add_arm_needs_features():
+    env = new_linear_environment()
+    for features in (None, [1., 2., 3.]):
+        try:
+            env.add_arm(name='3', features=features)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('added an arm without a valid feature row')
+    assert env.k == 3
+
+
+def test_linear_posterior():
+    features = np.array([[1., 0.], [1., 1.], [1., 2.]])
+    arm = LinearArm(features, prior_precision=2., noise_variance=4.)
+    stats = np.array([summarize(np.random.normal(mu, 2., n))
+                      for mu, n in ((1., 30), (2., 0), (3., 50))])
+    precision = 2. * np.eye(2) + np.dot(features.T * stats[:, N], features) / 4.
+    cholesky, mean = arm.get_posterior(stats)
+    assert np.allclose(np.dot(cholesky, cholesky.T), precision)
+    assert np.allclose(mean, np.linalg.solve(precision, np.dot(stats[:, SUM], features) / 4.))
+    assert arm.sample_means(stats, 10).shape == (3, 10)
+    assert np.isfinite(arm.sample_stats(stats[0], 10)).all()
+    assert sorted(vars(arm)) == ['arm_effects', 'base_features', 'noise_variance',
+                                 'prior_precision']
+
+
+def test_linear_min_size():
+    env = new_linear_environment()
+    env.run_cycle(incremental=True)
+    env.add_arm(name='3', features=[1., 3.])
+    env.run_cycle(incremental=True, min_size=1)
+    assert env.k == 4 and 0 < env.allocation.max() < 3
+
+
+def test_linear_whitelist():
+    env = new_linear_environment()
+    for _ in xrange(3):
+        env.run_cycle(incremental=True)
+    assert len(env.get_whitelist(1, n_samples=1000)) == env.k
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
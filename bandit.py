@@ -4,10 +4,19 @@
 
 """Algorithms for selecting arms for multi armed bandit"""
 
+import os
+import logging
 import numpy as np
-import pandas as pd
+from analytics.bandit.lazy import LazyModule
 from datetime import timedelta
-import time
+from analytics.bandit.environment import parse_allocation
+from analytics.bandit.arm import BinomialArm, LinearArm
+from analytics.bandit.arm_stats import ArmState, N, N_POS, SUM, SUM_SQ
+from analytics.bandit.compare import rank_top, DEFAULT_TOP_SAMPLES, DEFAULT_CHUNK_SIZE
+from analytics.bandit.gittins import get_table_path, load_table, brezzi_lai_index, \
+    DEFAULT_DISCOUNT, DEFAULT_TABLE_SIZE, QUANTIZATION, TABLE_DIRECTORY
+
+pd = LazyModule('pandas')
 
 
 class Bandit(object):
@@ -30,6 +39,32 @@ class Bandit(object):
 
         return data
 
+    @staticmethod
+    def get_stats(k, arm, data, run_date, sliding_window):
+        """Returns a k by s array of the sufficient statistics of each arm's rewards within the last
+        sliding_window days. data holds an ArmState or a series of raw rewards for each arm."""
+        stats = []
+        for i in xrange(k):
+            if isinstance(data[i], ArmState):
+                stats.append(data[i].get_stats(run_date, sliding_window))
+            else:
+                arm_data = Bandit.filter_data(1, [data[i]], run_date, sliding_window)[0]
+                stats.append(arm.summarize(arm_data))
+        return np.array(stats)
+
+    @staticmethod
+    def select_best(index, batch):
+        """Returns an allocation of the whole batch to the arm with the highest index, breaking ties
+        at random"""
+        best_arms = np.flatnonzero(index == index.max())
+        return pd.Series(best_arms[np.random.randint(len(best_arms), size=batch)])
+
+    @staticmethod
+    def get_means(stats):
+        """Returns the mean reward of each arm, with -inf for arms without rewards"""
+        counts = stats[:, N]
+        return np.where(counts > 0, stats[:, SUM] / np.where(counts > 0, counts, 1), -np.inf)
+
 
 class RandomBandit(Bandit):
     """This policy will choose an arm at random. This is mainly for testing"""
@@ -65,8 +100,8 @@ class NaiveBandit(Bandit):
 
     def select_arm(self, k, arm, data, allocation, start_date, run_date, sliding_window, batch):
         num_days = (run_date - start_date).days
-        data_sizes = [len(i) for i in data]
-        pulls = sum(data_sizes)
+        stats = self.get_stats(k, arm, data, run_date, None)
+        pulls = stats[:, N].sum()
         test_done = False
         if self.both:
             if num_days > self.n_days and pulls > self.n_pulls:
@@ -78,8 +113,7 @@ class NaiveBandit(Bandit):
                 test_done = True
 
         if test_done:
-            data_means = [np.mean(i) for i in data]
-            best_arm = np.argmax(data_means)
+            best_arm = np.argmax(self.get_means(stats))
             allocation = pd.Series(best_arm).repeat(batch)
 
         return allocation
@@ -103,21 +137,13 @@ class EpsilonGreedyBandit(Bandit):
     def select_arm(self, k, arm, data, allocation, start_date, run_date, sliding_window, batch):
         choose_epsilon = np.random.random(batch) < self.epsilon
 
-        data = self.filter_data(k, data, run_date, sliding_window)
+        stats = self.get_stats(k, arm, data, run_date, sliding_window)
+        data_means = self.get_means(stats)
+        best_arms = np.flatnonzero(data_means == data_means.max())
 
-        data_means = [np.mean(i) for i in data]
-        max_arm = max(data_means)
-        is_max_arm = (data_means == max_arm)
-
-        if sum(is_max_arm) > 1:
-            best_arms = [i for i, b in enumerate(is_max_arm) if b]
-            best_arms_allocation = np.random.choice(best_arms, size=batch)
-            random_arms = np.random.randint(low=0, high=k, size=batch)
-            allocation = np.where(choose_epsilon, random_arms, best_arms_allocation)
-        else:
-            best_arm = np.argmax(data_means)
-            random_arms = np.random.randint(low=0, high=k, size=batch)
-            allocation = np.where(choose_epsilon, random_arms, best_arm)
+        best_arms_allocation = best_arms[np.random.randint(len(best_arms), size=batch)]
+        random_arms = np.random.randint(low=0, high=k, size=batch)
+        allocation = np.where(choose_epsilon, random_arms, best_arms_allocation)
 
         return pd.Series(allocation)
 
@@ -126,37 +152,281 @@ class BayesianBandit(Bandit):
     """
     The Bayesian bandit will build a posterior distribution using a conjugate prior and observed
     rewards. It will then sample from these distributions and choose the arm with the highest
-    sampled reward.
+    sampled reward. If tolerance is set, it samples until the allocation shares are that precise.
     """
     NAME = "bayesian"
 
+    # defaults for environments pickled before adaptive sampling existed
+    tolerance = None
+    increment = 1000
+    max_samples = 100000
+    n_samples = None
+    precision = None
+
+    def __init__(self, tolerance=None, increment=1000, max_samples=100000):
+        """tolerance - Maximum standard error of the allocation shares before sampling stops.
+        increment - Number of samples drawn per arm on each adaptive iteration.
+        max_samples - Cap on the number of samples drawn per arm."""
+        if tolerance is not None and increment > max_samples:
+            raise RuntimeError('Sample increment is larger than the sample cap')
+        self.tolerance = tolerance
+        self.increment = increment
+        self.max_samples = max_samples
+
     def __str__(self):
         return 'bayesian bandit'
 
     def select_arm(self, k, arm, data, allocation, start_date, run_date, sliding_window, batch):
-        results = pd.DataFrame()
+        stats = self.get_stats(k, arm, data, run_date, sliding_window)
 
-        filter_start = time.time()
-        data = self.filter_data(k, data, run_date, sliding_window)
-        filter_end = time.time()
+        if self.tolerance is None:
+            results = pd.DataFrame()
+            for i in xrange(k):
+                results[i] = arm.sample_stats(stats[i], batch)
+            self.n_samples = batch
+            self.precision = None
+            return results.idxmax(axis=1)
+
+        shares, self.n_samples, self.precision = self.sample_shares(k, arm, stats)
+        counts = parse_allocation(shares, batch)
+        return pd.Series(np.repeat(np.arange(k), counts))
+
+    def sample_shares(self, k, arm, stats):
+        """Estimates the share of posterior samples won by each arm, drawing samples in increments
+        until the largest standard error of the shares is within tolerance or the cap is hit.
+        Returns the shares, the number of samples drawn per arm and the achieved precision."""
+        wins = np.zeros(k)
+        n_samples = 0
+        precision = np.inf
+
+        while n_samples < self.max_samples:
+            n = min(self.increment, self.max_samples - n_samples)
+            samples = np.column_stack([arm.sample_stats(stats[i], n) for i in xrange(k)])
+            wins += np.bincount(np.argmax(samples, axis=1), minlength=k)
+            n_samples += n
+
+            shares = wins / n_samples
+            precision = np.sqrt(np.max(shares * (1 - shares)) / n_samples)
+            if precision <= self.tolerance:
+                break
+
+        return wins / n_samples, n_samples, precision
+
+
+class UCBBandit(Bandit):
+    """
+    The UCB1 policy gives the batch to the arm with the highest upper confidence bound
+    mean + scale * sqrt(2 * ln(t) / n). Arms that have not been pulled come first.
+    """
+    NAME = "ucb"
 
-        filter_time = filter_end - filter_start
-        sample_time = 0
+    def __init__(self, scale=1.):
+        """scale - Range of the rewards, which is 1 for binomial rewards"""
+        self.scale = scale
 
-        for i in xrange(k):
-            filter_start = time.time()
-            data_arm = data[i]
-            filter_end = time.time()
-            filter_time = filter_time + filter_end - filter_start
-            start_sample = time.time()
-            samples = arm.sample(data_arm, batch)
-            end_sample = time.time()
-            results[i] = samples
-            sample_time = sample_time + (end_sample - start_sample)
-
-        allocation = results.idxmax(axis=1)
+    def __str__(self):
+        return 'ucb1 bandit'
 
-        return allocation
+    def select_arm(self, k, arm, data, allocation, start_date, run_date, sliding_window, batch):
+        stats = self.get_stats(k, arm, data, run_date, sliding_window)
+        counts = stats[:, N]
+        total = counts.sum()
+
+        bonus = self.scale * np.sqrt(2 * np.log(max(total, 1)) / np.where(counts > 0, counts, 1))
+        index = np.where(counts > 0, self.get_means(stats) + bonus, np.inf)
+
+        return self.select_best(index, batch)
+
+
+class KLUCBBandit(Bandit):
+    """
+    The KL-UCB policy gives the batch to the arm with the highest upper confidence bound q such
+    that n * KL(mean, q) <= ln(t) + c * ln(ln(t)).
+    """
+    NAME = "klucb"
+    KINDS = ('bernoulli', 'gaussian')
+    ITERATIONS = 32
+    DEFAULT_SIGMA = 1.
+
+    def __init__(self, kind='bernoulli', c=0., sigma=None):
+        """kind - Reward distribution, either bernoulli or gaussian.
+        c - Weight of the ln(ln(t)) term of the exploration bound.
+        sigma - Standard deviation of gaussian rewards. Estimated per arm from the data if None,
+            using the pooled estimate of all arms for arms with less than 2 rewards."""
+        if kind not in self.KINDS:
+            raise RuntimeError('Incorrect input for kind. Formats include bernoulli or gaussian')
+        self.kind = kind
+        self.c = c
+        self.sigma = sigma
+
+    def __str__(self):
+        return 'kl-ucb bandit ({})'.format(self.kind)
+
+    @staticmethod
+    def bernoulli_kl(p, q):
+        """Kullback-Leibler divergence between bernoulli distributions with means p and q"""
+        p = np.clip(p, 1e-15, 1 - 1e-15)
+        q = np.clip(q, 1e-15, 1 - 1e-15)
+        return p * np.log(p / q) + (1 - p) * np.log((1 - p) / (1 - q))
+
+    def bernoulli_index(self, means, bound):
+        """Largest q in [mean, 1] with KL(mean, q) <= bound for all arms, by vectorized bisection"""
+        low = means
+        high = np.ones_like(means)
+        for _ in xrange(self.ITERATIONS):
+            mid = (low + high) / 2
+            over = self.bernoulli_kl(means, mid) > bound
+            high = np.where(over, mid, high)
+            low = np.where(over, low, mid)
+        return low
+
+    def pooled_sigma(self, counts, ssd):
+        """Pooled standard deviation of the arms with at least 2 rewards, or DEFAULT_SIGMA"""
+        pooled = counts > 1
+        total_ssd = ssd[pooled].sum()
+        if total_ssd == 0:
+            return self.DEFAULT_SIGMA
+        return np.sqrt(total_ssd / (counts[pooled] - 1).sum())
+
+    def select_arm(self, k, arm, data, allocation, start_date, run_date, sliding_window, batch):
+        stats = self.get_stats(k, arm, data, run_date, sliding_window)
+        counts = stats[:, N]
+        pulled = counts > 0
+        safe_counts = np.where(pulled, counts, 1)
+        means = np.where(pulled, stats[:, SUM] / safe_counts, 0.)
+
+        log_total = np.log(max(counts.sum(), 1))
+        bound = (log_total + self.c * np.log(max(log_total, 1))) / safe_counts
+
+        if self.kind == 'bernoulli':
+            index = self.bernoulli_index(np.clip(means, 0, 1), bound)
+        else:
+            if self.sigma is not None:
+                sigma = self.sigma
+            else:
+                ssd = np.maximum(stats[:, SUM_SQ] - counts * means ** 2, 0)
+                sigma = self.pooled_sigma(counts, ssd)
+                sigma = np.where(counts > 1, np.sqrt(ssd / np.maximum(counts - 1, 1)), sigma)
+            index = means + sigma * np.sqrt(2 * bound)
+
+        return self.select_best(np.where(pulled, index, np.inf), batch)
+
+
+class GittinsBandit(Bandit):
+    """
+    The Gittins bandit gives the batch to the binomial arm with the highest Gittins index, looked
+    up in a table generated ahead of time with gittins.py, or else from the Brezzi-Lai
+    approximation.
+    """
+    NAME = "gittins"
+
+    # set once a missing table has been warned about, so the warning is not repeated every cycle
+    table_missing = False
+
+    def __init__(self, discount=DEFAULT_DISCOUNT, size=DEFAULT_TABLE_SIZE, path=None,
+                 directory=TABLE_DIRECTORY):
+        """discount - Discount per pull the table was generated for.
+        path - Path of the table, by default the table for discount and size in directory."""
+        self.discount = discount
+        self.size = size
+        self.path = get_table_path(discount, size, directory) if path is None else path
+        self.table = None
+
+    def __str__(self):
+        return 'gittins bandit (discount={})'.format(self.discount)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['table'] = None
+        state.pop('table_missing', None)
+        return state
+
+    def get_table(self):
+        """Returns the memory mapped table, or None if it has not been generated"""
+        if self.table is None:
+            if self.table_missing:
+                return None
+            if not os.path.isfile(self.path):
+                logging.warning('No Gittins table at {}, using the Brezzi-Lai approximation'.format(
+                    self.path))
+                self.table_missing = True
+                return None
+            self.table = load_table(self.path)
+        return self.table
+
+    def get_indices(self, a, b):
+        """Returns the Gittins indices of beta states with parameters a and b"""
+        indices = brezzi_lai_index(a, b, self.discount)
+        table = self.get_table()
+        if table is None:
+            return indices
+
+        size = table.shape[0] - 1
+        rounded_a = np.round(a).astype(int)
+        rounded_b = np.round(b).astype(int)
+        in_table = (rounded_a >= 1) & (rounded_b >= 1) & (rounded_a <= size) & (rounded_b <= size)
+        indices[in_table] = table[rounded_a[in_table], rounded_b[in_table]] / float(QUANTIZATION)
+        return indices
+
+    def select_arm(self, k, arm, data, allocation, start_date, run_date, sliding_window, batch):
+        if not isinstance(arm, BinomialArm):
+            raise RuntimeError('The Gittins bandit only supports binomial arms')
+        stats = self.get_stats(k, arm, data, run_date, sliding_window)
+        a = arm.alpha + stats[:, N_POS]
+        b = arm.beta + stats[:, N] - stats[:, N_POS]
+        return self.select_best(self.get_indices(a, b), batch)
+
+
+class LinearThompsonBandit(Bandit):
+    """
+    The linear Thompson bandit draws weights from a LinearArm's posterior for every slot of the
+    batch and gives each slot to the arm with the highest sampled mean.
+    """
+    NAME = "linear_thompson"
+
+    def __str__(self):
+        return 'linear thompson bandit'
+
+    def select_arm(self, k, arm, data, allocation, start_date, run_date, sliding_window, batch):
+        if not isinstance(arm, LinearArm):
+            raise RuntimeError('The linear Thompson bandit only supports linear arms')
+        samples = arm.sample_means(self.get_stats(k, arm, data, run_date, sliding_window), batch)
+        # arms with the same features draw the same means, so break ties randomly per slot
+        best = samples == samples.max(axis=0)
+        return pd.Series(np.argmax(best * np.random.random(best.shape), axis=0))
+
+
+class TopBandit(Bandit):
+    """
+    The top bandit picks m winners, such as a whitelist of publishers, splitting the batch by each
+    arm's posterior probability of being among the m best. The last ranking is kept as report.
+    """
+    NAME = "top"
+
+    report = None
+
+    def __init__(self, m=1, n_samples=DEFAULT_TOP_SAMPLES, chunk_size=DEFAULT_CHUNK_SIZE):
+        """m - Number of winners.
+        n_samples - Number of posterior samples drawn per arm.
+        chunk_size - Number of samples per arm held in memory at once."""
+        self.m = m
+        self.n_samples = n_samples
+        self.chunk_size = chunk_size
+
+    def __str__(self):
+        return 'top {} bandit'.format(self.m)
+
+    def get_report(self, k, arm, data, run_date, sliding_window, names=None):
+        """Returns the ranked arms with their probability of being in the top m, expected loss
+        and whether they make the whitelist"""
+        return rank_top(arm, self.get_stats(k, arm, data, run_date, sliding_window), self.m,
+                        self.n_samples, self.chunk_size, names)
+
+    def select_arm(self, k, arm, data, allocation, start_date, run_date, sliding_window, batch):
+        self.report = self.get_report(k, arm, data, run_date, sliding_window).sort_index()
+        shares = self.report.p_top.values / self.report.p_top.sum()
+        counts = parse_allocation(shares, batch)
+        return pd.Series(np.repeat(np.arange(k), counts))
 
 
 ALL_BANDIT_MODELS = {x.NAME: x for x in Bandit.__subclasses__()}
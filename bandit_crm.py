@@ -5,8 +5,9 @@
 """Manages a bandit environment using the analytics crm system"""
 
 from analytics.bandit.environment import Environment, parse_allocation
+from analytics.bandit.engine import allocate_batch
 from analytics.bandit.bandit_queries import get_udid_table, crm_retention_query,\
-    crm_conversion_query, crm_cumarpu_query
+    crm_conversion_query, crm_cumarpu_query, crm_metrics_query
 from datetime import date, timedelta
 from analytics.db import redshift
 from analytics.db.redshift_util import RedshiftDictWriter
@@ -19,6 +20,50 @@ STORAGE_PATH = '/mnt/bandit'
 POST_BATCH_SIZE = 100
 
 
+class CohortTracker(object):
+    """Tracks which (arm, join date) cohorts of a day N metric have been folded into an
+    environment, so each update only fetches and adds newly matured cohorts"""
+
+    def __init__(self, day, matured_through=None):
+        """matured_through - Last join date whose cohorts have been folded in."""
+        self.day = day
+        self.matured_through = matured_through
+        self.folded = set()
+
+    def get_last_mature_date(self, run_date):
+        """Returns the last join date whose outcomes are complete by run_date"""
+        return run_date - timedelta(days=self.day + 1)
+
+    def get_start_date(self, start_date):
+        """Returns the first join date not folded in yet"""
+        if self.matured_through is None:
+            return start_date
+        return max(start_date, self.matured_through + timedelta(days=1))
+
+    def get_pending(self, start_date, run_date):
+        """Returns the join dates from start_date through run_date whose cohorts are still
+        immature"""
+        first = max(self.get_start_date(start_date),
+                    self.get_last_mature_date(run_date) + timedelta(days=1))
+        return [first + timedelta(days=i) for i in xrange((run_date - first).days)]
+
+    def has_matured(self, start_date, run_date):
+        """Returns True if cohorts have matured since the last update"""
+        return self.get_start_date(start_date) <= self.get_last_mature_date(run_date)
+
+    def fold(self, data, run_date):
+        """Returns the rows of crm data from cohorts not folded in yet and marks their cohorts
+        and every join date matured by run_date as folded"""
+        if data is not None and not data.empty:
+            keys = pd.Series(zip(data.shard, data.date_joined), index=data.index)
+            data = data[~keys.isin(self.folded)]
+            self.folded.update(keys[data.index])
+        last_mature_date = self.get_last_mature_date(run_date)
+        if self.matured_through is None or last_mature_date > self.matured_through:
+            self.matured_through = last_mature_date
+        return data
+
+
 class BaseBanditCRM(object):
     """Base class for daily crm bandit"""
 
@@ -50,9 +95,11 @@ class BanditCRM(BaseBanditCRM):
         self.game = game
         self.bandit_params = bandit_params
         self.start_date = start_date
-        self.filename = 'crm2_' + self.test_name + '.pkl'
+        self.filename = 'crm2_{}_{}.pkl'.format(self.test_name, self.metric)
         self.path = os.path.join(STORAGE_PATH, self.filename)
+        self.cohorts = None
         self.allocation_table = 'crm2groupchanges'
+        self.updated = False
 
     def get_test_name(self):
         """Returns string describing bandit crm report"""
@@ -69,21 +116,84 @@ class BanditCRM(BaseBanditCRM):
 
     def run(self):
         """Runs daily crm bandit"""
+        env = self.get_environment()
+        return self.publish(env)
+
+    def get_environment(self, allocate=True, crm_data=None):
+        """Loads the environment and updates it with new data, or creates and backfills it
+        allocate: if False, the new data is added without computing a new allocation
+        crm_data: data already fetched for several metrics by get_crm_metrics"""
+        env = self.load_environment()
+        return self.update_environment(env, self.get_update_start_date(env), allocate, crm_data)
+
+    def load_environment(self):
+        """Loads the saved environment and its cohort tracker, or returns None for a new test"""
         if os.path.isfile(self.path):
-            logging.info('updating bandit')
             with open(self.path, 'rb') as pickle_input:
                 env = pickle.load(pickle_input)
-
+                self.cohorts = self.load_cohorts(env, pickle_input)
             if self.start_date is None:
                 self.start_date = env.start_date
-            if self.run_date > env.run_date:
-                self.update(env, env.run_date - timedelta(days=self.day), self.run_date)
-
-        else:
+            return env
+
+        if self.start_date is None:
+            self.start_date = date.today()
+        self.cohorts = CohortTracker(self.day)
+        return None
+
+    def get_update_start_date(self, env):
+        """Returns the first join date to fetch for a loaded environment, or None if no cohorts
+        have matured since its last update"""
+        if env is None:
+            return self.start_date
+        if self.run_date > env.run_date and \
+                self.cohorts.has_matured(self.start_date, self.run_date):
+            return self.cohorts.get_start_date(self.start_date)
+        return None
+
+    def update_environment(self, env, start_date, allocate=True, crm_data=None):
+        """Updates a loaded environment with the newly matured cohorts, or creates and backfills
+        it if env is None
+        start_date: first join date to fetch, from get_update_start_date"""
+        self.updated = start_date is not None
+        if env is None:
             logging.info('creating and backfilling bandit')
-            if self.start_date is None:
-                self.start_date = date.today()
-            env = self.backfill()
+            return self.backfill(allocate=allocate, crm_data=crm_data)
+
+        if self.updated:
+            logging.info('updating bandit')
+            self.update(env, start_date, self.run_date, allocate=allocate, crm_data=crm_data)
+        return env
+
+    def load_cohorts(self, env, pickle_input):
+        """Loads the cohort tracker saved after the environment, or starts one from the
+        environment's run date for environments saved before cohorts were tracked, which had
+        folded every cohort maturing before it"""
+        try:
+            return pickle.load(pickle_input)
+        except EOFError:
+            return CohortTracker(self.day, env.run_date - timedelta(days=self.day + 1))
+
+    def save(self, env):
+        """Saves the environment and its cohort tracker to one file, written to a temporary file
+        and renamed so readers never see one without the other"""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as output:
+            pickle.dump(env, output, -1)
+            pickle.dump(self.cohorts, output, -1)
+        os.rename(temp_path, self.path)
+
+    def publish(self, env, post=True):
+        """Saves the environment and writes its allocation to the crm2 allocation table
+        post: if False, the allocation is only returned, not written"""
+        self.save(env)
+
+        if getattr(env.bandit, 'precision', None) is not None:
+            logging.info('Allocation shares within {:.4f} using {} samples per arm'.format(
+                env.bandit.precision, env.bandit.n_samples))
+
+        if not post:
+            return parse_allocation(env.get_allocation(sort=False), POST_BATCH_SIZE, 2)
 
         allocation_report = env.get_allocation(sort=False)
         allocation_report = pd.DataFrame({'date': self.run_date,
@@ -131,20 +241,47 @@ class BanditCRM(BaseBanditCRM):
 
         return crm_data
 
-    def backfill(self):
+    def get_crm_metrics(self, metrics, start_date=None, run_date=None):
+        """Get several metrics of the test in one pass, with a column per metric"""
+
+        if start_date is None:
+            start_date = self.start_date
+
+        if run_date is None:
+            run_date = self.run_date
+
+        with redshift.managed_db_conn() as rdb:
+            get_udid_table(rdb, self.game, self.test_name, start_date, run_date, self.day)
+            crm_data = crm_metrics_query(rdb, self.game, self.day, metrics)
+
+        return crm_data
+
+    def backfill(self, allocate=True, crm_data=None):
         """Create environment for the ab test"""
 
         env = Environment(**self.bandit_params)
-        env = self.update(env, self.start_date, self.run_date)
+        env = self.update(env, self.start_date, self.run_date, allocate=allocate,
+                          crm_data=crm_data)
 
         return env
 
-    def update(self, env, start_date=None, run_date=None):
+    def update(self, env, start_date=None, run_date=None, allocate=True, crm_data=None):
         """update environment with data from users installing on start_date to data received
-        by run_date"""
+        by run_date
+        crm_data: data already fetched for several metrics, from which this test's metric is
+        taken instead of querying it"""
 
-        logging.info('Getting CRM user data')
-        update_data = self.get_crm_data(start_date, run_date)
+        if crm_data is None:
+            logging.info('Getting CRM user data')
+            update_data = self.get_crm_data(start_date, run_date)
+        else:
+            update_data = crm_data[crm_data.date_joined >= (start_date or self.start_date)]
+            update_data = update_data.assign(value=update_data[self.metric])
+        if self.cohorts is not None:
+            update_data = self.cohorts.fold(update_data,
+                                            run_date if run_date is not None else self.run_date)
+            logging.info('{} cohort days still pending'.format(
+                len(self.cohorts.get_pending(self.start_date, self.run_date))))
 
         update_data_input = [None] * self.k
 
@@ -156,9 +293,43 @@ class BanditCRM(BaseBanditCRM):
                 update_data_input[i] = arm_series
 
         logging.info('Updating bandit environment')
-        env.run_cycle(run_date=self.run_date, new_data=update_data_input)
-
-        with open(self.path, 'wb') as output:
-            pickle.dump(env, output, -1)
+        env.run_cycle(run_date=self.run_date, new_data=update_data_input, allocate=allocate)
 
         return env
+
+
+def run_batch(reports):
+    """Runs many daily crm bandits, computing all of their allocations in one vectorized pass
+    instead of one environment at a time"""
+    envs = [report.get_environment(allocate=False) for report in reports]
+    allocate_batch([env for report, env in zip(reports, envs) if report.updated],
+                   run_dates=[report.run_date for report in reports if report.updated])
+    return [report.publish(env) for report, env in zip(reports, envs)]
+
+
+def run_metrics(reports):
+    """Runs daily crm bandits tracking different metrics of the same test, fetching every metric
+    in one query that scans the sessions and iaps tables once, instead of one query per metric.
+    Each bandit only folds in its own newly matured cohorts from the shared data and is saved
+    to its own file. The test has one allocation group, so only the first report's allocation is
+    written to the allocation table; every allocation is returned."""
+    first = reports[0]
+    if any((report.game, report.test_name, report.day, report.run_date) !=
+           (first.game, first.test_name, first.day, first.run_date) for report in reports):
+        raise RuntimeError('Metrics fetched together must share the game, test, day and run date')
+
+    envs = [report.load_environment() for report in reports]
+    start_dates = [report.get_update_start_date(env) for report, env in zip(reports, envs)]
+    new_start_dates = [start_date for start_date in start_dates if start_date is not None]
+    crm_data = None
+    if new_start_dates:
+        logging.info('Getting CRM user data for {}'.format(
+            ', '.join(report.metric for report in reports)))
+        crm_data = first.get_crm_metrics(sorted(set(report.metric for report in reports)),
+                                         min(new_start_dates), first.run_date)
+
+    envs = [report.update_environment(env, start_date, allocate=False, crm_data=crm_data)
+            for report, env, start_date in zip(reports, envs, start_dates)]
+    allocate_batch([env for report, env in zip(reports, envs) if report.updated],
+                   run_dates=[report.run_date for report in reports if report.updated])
+    return [report.publish(env, post=report is first) for report, env in zip(reports, envs)]
@@ -102,6 +102,45 @@ CUMARPU_QUERY = """
     GROUP BY a.udid, a.shard, a.date
 """
 
+# one aggregate per source table, so every requested metric costs a single scan of each table
+CRM_METRICS_QUERY = """
+    WITH {ctes}
+    SELECT a.udid,
+           a.shard,
+           a.date as date_joined,
+           a.date + {day} as date,
+           {columns}
+    FROM udid_table a
+    {joins}
+"""
+
+CRM_SESSIONS_CTE = """sessions_agg AS (
+        SELECT a.udid,
+               a.date,
+               1 AS retention
+        FROM udid_table a
+        INNER JOIN {game}.sessions b
+        ON a.udid = b.udid
+        AND b.date = a.date + {day}
+        GROUP BY a.udid, a.date
+    )"""
+
+CRM_IAPS_CTE = """iaps_agg AS (
+        SELECT a.udid,
+               a.date,
+               1 AS conversion,
+               sum(coalesce(b.rev, 0)) AS cumarpu
+        FROM udid_table a
+        INNER JOIN {game}.iaps b
+        ON a.udid = b.udid
+        AND b.date between a.date and a.date + {day}
+        GROUP BY a.udid, a.date
+    )"""
+
+CRM_METRIC_SOURCES = {'retention': 'sessions_agg', 'conversion': 'iaps_agg',
+                      'cumarpu': 'iaps_agg'}
+CRM_SOURCE_CTES = {'sessions_agg': CRM_SESSIONS_CTE, 'iaps_agg': CRM_IAPS_CTE}
+
 
 def publisher_query(db, channel, start_date, run_date, day=1):
     """"Get latest session data per user in the past week"""
@@ -202,3 +241,29 @@ def crm_cumarpu_query(db, game, day):
     df = return_query_as_df(db, query)
 
     return df
+
+
+def crm_metrics_query(db, game, day, metrics):
+    """Get several crm metrics in one query with a column per metric, scanning the sessions and
+    iaps tables at most once each"""
+
+    unknown = [metric for metric in metrics if metric not in CRM_METRIC_SOURCES]
+    if unknown:
+        raise RuntimeError('Unknown crm metrics {}. Formats include retention, conversion or '
+                           'cumarpu'.format(unknown))
+
+    sources = sorted(set(CRM_METRIC_SOURCES[metric] for metric in metrics))
+    query = CRM_METRICS_QUERY.format(
+        ctes=',\n    '.join(CRM_SOURCE_CTES[source].format(game=game, day=day)
+                            for source in sources),
+        columns=',\n           '.join('coalesce({}.{}, 0) AS {}'.format(
+            CRM_METRIC_SOURCES[metric], metric, metric) for metric in metrics),
+        joins='\n    '.join('LEFT JOIN {0} ON a.udid = {0}.udid AND a.date = {0}.date'.format(
+            source) for source in sources),
+        day=day,
+    )
+
+    logging.info('Fetching crm {} data'.format(', '.join(metrics)))
+    df = return_query_as_df(db, query)
+
+    return df
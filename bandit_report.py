@@ -11,9 +11,12 @@ from analytics.tasking.command import Command
 from analytics.bandit.arm import *
 from analytics.bandit.bandit import *
 from analytics.bandit.environment import *
+from analytics.bandit.arm_stats import reduce_partitions
+from analytics.bandit.sketch import DEFAULT_SKETCH_SIZE
 from analytics.db import redshift
 from analytics.shared import ClassProperty
 from analytics.db.redshift_util import RedshiftDictWriter
+from functools import partial
 import cPickle as pickle
 import os.path
 import time
@@ -22,6 +25,13 @@ import logging
 DEFAULT_START_DATE = date(2016, 1, 1)
 DEFAULT_MIN_SIZE = 50
 STORAGE_PATH = '/mnt/bandit'
+BACKFILL_PARTITION_DAYS = 30
+WHITELIST_COLUMNS = ['p_top', 'expected_loss', 'whitelist']
+
+
+def get_quantile_column(q):
+    """Returns the performance report column of a quantile, such as p90 for .9"""
+    return 'p{:g}'.format(q * 100)
 
 
 def daterange(start_date, end_date):
@@ -30,6 +40,22 @@ def daterange(start_date, end_date):
         yield start_date + timedelta(n)
 
 
+def date_partitions(start_date, end_date, days):
+    """returns (start, end) pairs splitting start_date to end_date into ranges of at most days"""
+    partitions = []
+    while start_date < end_date:
+        partition_end = min(start_date + timedelta(days), end_date)
+        partitions.append((start_date, partition_end))
+        start_date = partition_end
+    return partitions
+
+
+def load_publisher_retention(channel, start_date, run_date, day):
+    """Fetches publisher retention data for one partition of a backfill"""
+    with redshift.managed_db_conn() as rdb:
+        return publisher_retention_query(rdb, channel, start_date, run_date, day)
+
+
 class BanditReporter(Command):
     """Base class for daily bandit reports"""
 
@@ -55,7 +81,13 @@ class BanditReporter(Command):
 class ApplovinBanditReporter(BanditReporter):
     """Runs daily bandit for determining whitelist/blacklist allocations for Applovin publishers"""
     def __init__(self, start_date=None, run_date=None, sliding_window=None, ret_day=1,
-                 min_size=None):
+                 min_size=None, backfill_processes=None, quantiles=None, whitelist_size=None):
+        """backfill_processes - If set, the backfill is split into date partitions that are
+        fetched and summarized by this many worker processes, then merged into the environment.
+        quantiles - Adds a p<percent> column per quantile to the performance report, computed
+        from quantile sketches kept by the environment.
+        whitelist_size - Adds each publisher's probability of being among the whitelist_size best,
+        its expected loss and whether it makes the whitelist to the performance report."""
         super(ApplovinBanditReporter, self).__init__(
             run_date=run_date
         )
@@ -69,6 +101,9 @@ class ApplovinBanditReporter(BanditReporter):
             self.start_date = start_date
         self.ret_day = ret_day
         self.min_size = DEFAULT_MIN_SIZE if min_size is None else min_size
+        self.backfill_processes = backfill_processes
+        self.quantiles = quantiles
+        self.whitelist_size = whitelist_size
         self.report_description = 'Applovin'
         self.channel = 'applovin'
         self.filename = self.report_description + '.pkl'
@@ -97,14 +132,19 @@ class ApplovinBanditReporter(BanditReporter):
         return columns, str_columns
 
     @staticmethod
-    def get_performance_columns(sliding_window=None):
+    def get_performance_columns(sliding_window=None, quantiles=None, whitelist_size=None):
         """Column names for performance report"""
         other_columns = ['run_date', ]
         str_columns = ['publisher', ]
+        quantile_columns = [get_quantile_column(q) for q in quantiles or []]
         if sliding_window is not None:
-            performance_columns = ['len', 'mean', 'std', 'sem', 'len_sw', 'mean_sw', 'std_sw', 'sem_sw', ]
+            performance_columns = ['len', 'mean', 'std', 'sem'] + quantile_columns + \
+                ['len_sw', 'mean_sw', 'std_sw', 'sem_sw'] + \
+                [x + '_sw' for x in quantile_columns]
         else:
-            performance_columns = ['len', 'mean', 'std', 'sem', ]
+            performance_columns = ['len', 'mean', 'std', 'sem', ] + quantile_columns
+        if whitelist_size is not None:
+            performance_columns += WHITELIST_COLUMNS
         columns = other_columns + str_columns + performance_columns
         return columns, str_columns
 
@@ -135,19 +175,31 @@ class ApplovinBanditReporter(BanditReporter):
                                           'allocation': allocation_report.tolist()})
         allocation_report = allocation_report.to_dict('records')
 
-        performance_report = env.get_performance(sort=True, sliding_window=False)
+        quantile_columns = {'q{}'.format(q): get_quantile_column(q)
+                            for q in self.quantiles or []}
+        performance_report = env.get_performance(sort=True, sliding_window=False,
+                                                 quantiles=self.quantiles)
         performance_report.len = performance_report.len.apply(int)
+        performance_report.rename(columns=quantile_columns, inplace=True)
         if self.sliding_window is None:
             pass
         else:
-            performance_report_sw = env.get_performance(sort=True, sliding_window=True)
+            performance_report_sw = env.get_performance(sort=True, sliding_window=True,
+                                                        quantiles=self.quantiles)
             performance_report_sw.len = performance_report_sw.len.apply(int)
             performance_report_sw.rename(columns={'len': 'len_sw',
                                                   'mean': 'mean_sw',
                                                   'std': 'std_sw',
                                                   'sem': 'sem_sw'
                                                  }, inplace=True)
+            performance_report_sw.rename(columns={x: y + '_sw' for x, y in
+                                                  quantile_columns.iteritems()}, inplace=True)
             performance_report = pd.merge(performance_report, performance_report_sw, how='left', on='name')
+        if self.whitelist_size is not None:
+            whitelist = env.get_whitelist(self.whitelist_size)
+            whitelist['whitelist'] = whitelist.whitelist.astype(int)
+            performance_report = pd.merge(performance_report, whitelist[WHITELIST_COLUMNS],
+                                          how='left', left_on='name', right_index=True)
         performance_report.fillna(0, inplace=True)
         performance_report['run_date'] = self.run_date
         performance_report.rename(columns={'name': 'publisher'}, inplace=True)
@@ -164,7 +216,9 @@ class ApplovinBanditReporter(BanditReporter):
                 writer.copy_to_table(rdb.cur, 'public', self.allocation_table)
                 rdb.conn.commit()
 
-            columns, str_columns = self.get_performance_columns(self.sliding_window)
+            columns, str_columns = self.get_performance_columns(self.sliding_window,
+                                                                self.quantiles,
+                                                                self.whitelist_size)
             with RedshiftDictWriter(columns=columns, str_columns=str_columns) as writer:
 
                 logging.info('Writing to Applovin performance table')
@@ -216,7 +270,26 @@ class ApplovinBanditReporter(BanditReporter):
         env = Environment(k, BayesianBandit(), BinomialArm(alpha=1, beta=2),
                           arm_names=publisher_list, start_date=self.start_date,
                           run_date=self.run_date, sliding_window=self.sliding_window, batch=1000,
-                          label='Applovin Bayesian Bandit')
+                          label='Applovin Bayesian Bandit',
+                          sketch_size=DEFAULT_SKETCH_SIZE if self.quantiles else None)
+
+        if self.backfill_processes is not None:
+            partitions = [partial(load_publisher_retention, self.channel, start, end, self.ret_day)
+                          for start, end in date_partitions(self.start_date, self.run_date,
+                                                            BACKFILL_PARTITION_DAYS)]
+            sketches = None
+            states = reduce_partitions(partitions, env.arm, arm_column='publisher',
+                                       processes=self.backfill_processes,
+                                       sketch_size=env.sketch_size)
+            if env.sketch_size is not None:
+                states, sketches = states
+            env.merge_arm_states(states, day_sketches=sketches)
+            env.run_cycle(run_date=self.run_date, new_data=[None] * env.k, min_size=self.min_size)
+
+            with open(self.path, 'wb') as output:
+                pickle.dump(env, output, -1)
+
+            return env
 
         with redshift.managed_db_conn() as rdb:
             historical_data = publisher_retention_query(rdb, self.channel, self.start_date,
@@ -0,0 +1,76 @@
+"""Online change point detection on the daily rewards of an arm"""
+
+import numpy as np
+from analytics.bandit.arm_stats import moments
+
+
+class ChangeDetector(object):
+    """Detects a change in the distribution of an arm's rewards from daily sufficient statistics"""
+
+    def update(self, day, stats):
+        """Abstract method to add the statistics of a day's rewards. Returns True if a change was
+        detected, after which change_date and segment hold the first day and the statistics of the
+        rewards since the change."""
+        raise NotImplementedError
+
+    def reset(self):
+        """Abstract method to forget all rewards seen so far"""
+        raise NotImplementedError
+
+
+class PageHinkley(ChangeDetector):
+    """Two sided Page-Hinkley test for a shift in the mean reward, updated once per day
+    delta - Magnitude of shifts to ignore, in standard deviations per reward.
+    threshold - Cumulative deviation in standard deviations needed to signal a change. The
+        defaults gave no false alarms in 60000 simulated days of stationary normal or binomial
+        rewards. Heavy tailed rewards such as revenue need about twice the threshold.
+    min_size - Number of rewards needed before changes are signaled."""
+
+    def __init__(self, delta=.1, threshold=100., min_size=100):
+        self.delta = delta
+        self.threshold = threshold
+        self.min_size = min_size
+        self.reset()
+
+    def reset(self):
+        self.stats = None
+        self.change_date = None
+        self.segment = None
+        # cumulative deviations, their extremes, and the rewards since each extreme
+        self.up = self.up_min = 0.
+        self.down = self.down_max = 0.
+        self.up_segment = self.down_segment = None
+        self.up_date = self.down_date = None
+
+    def update(self, day, stats):
+        self.stats = stats if self.stats is None else self.stats + stats
+        n_total, mean, ssd = moments(self.stats)
+        n, day_mean, __ = moments(stats)
+        if n == 0:
+            return False
+
+        std = np.sqrt(ssd / n_total)
+        deviation = n * (day_mean - mean) / std if std > 0 else 0.
+        self.up += deviation - n * self.delta
+        self.down += deviation + n * self.delta
+
+        self.up_segment = stats if self.up_segment is None else self.up_segment + stats
+        self.down_segment = stats if self.down_segment is None else self.down_segment + stats
+        self.up_date = day if self.up_date is None else self.up_date
+        self.down_date = day if self.down_date is None else self.down_date
+
+        if n_total >= self.min_size:
+            if self.up - self.up_min > self.threshold:
+                self.change_date, self.segment = self.up_date, self.up_segment
+                return True
+            if self.down_max - self.down > self.threshold:
+                self.change_date, self.segment = self.down_date, self.down_segment
+                return True
+
+        # a new extreme means any change started after today
+        if self.up < self.up_min:
+            self.up_min, self.up_segment, self.up_date = self.up, None, None
+        if self.down > self.down_max:
+            self.down_max, self.down_segment, self.down_date = self.down, None, None
+
+        return False
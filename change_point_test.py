@@ -0,0 +1,45 @@
+"""
+Tests change point detection on simulated daily rewards
+"""
+from analytics.bandit.arm_stats import summarize
+from analytics.bandit.change_point import PageHinkley
+from datetime import date, timedelta
+import numpy as np
+
+START_DATE = date(2017, 4, 1)
+
+
+def count_alarms(draw, days=200, change_day=None, shift=0.):
+    """Returns the days a default detector signaled changes on and their change dates"""
+    detector = PageHinkley()
+    alarms = []
+    for cycle in xrange(days):
+        day = START_DATE + timedelta(days=cycle)
+        values = draw() + (shift if change_day is not None and cycle >= change_day else 0.)
+        if detector.update(day, summarize(values)):
+            alarms.append((cycle, detector.change_date))
+            detector.reset()
+    return alarms
+
+
+def test_stationary():
+    random = np.random.RandomState(0)
+    assert count_alarms(lambda: random.normal(size=500)) == []
+    assert count_alarms(lambda: random.binomial(1, .1, 500).astype(float)) == []
+
+
+def test_shift():
+    random = np.random.RandomState(0)
+    alarms = count_alarms(lambda: random.normal(size=500), days=100, change_day=50, shift=.3)
+    assert len(alarms) == 1
+    cycle, change_date = alarms[0]
+    assert 50 <= cycle <= 53
+    assert change_date >= START_DATE + timedelta(days=48)
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
@@ -0,0 +1,36 @@
+"""Cholesky factor updates for incremental bayesian linear regression"""
+
+import numpy as np
+from analytics.bandit.lazy import LazyModule
+
+linalg = LazyModule('scipy.linalg')
+
+
+def cholesky_update(L, x, downdate=False):
+    """Returns the lower triangular Cholesky factor of L L^T + x x^T, or of L L^T - x x^T if
+    downdate, in O(d^2) instead of the O(d^3) of refactorizing. Raises LinAlgError if a downdate
+    would leave the matrix not positive definite."""
+    L = L.copy()
+    x = np.array(x, dtype=float)
+    sign = -1. if downdate else 1.
+    for i in xrange(len(x)):
+        r_sq = L[i, i] ** 2 + sign * x[i] ** 2
+        if r_sq <= 0:
+            raise np.linalg.LinAlgError('Downdate is not positive definite')
+        r = np.sqrt(r_sq)
+        c = r / L[i, i]
+        s = x[i] / L[i, i]
+        L[i, i] = r
+        L[i + 1:, i] = (L[i + 1:, i] + sign * s * x[i + 1:]) / c
+        x[i + 1:] = c * x[i + 1:] - s * L[i + 1:, i]
+    return L
+
+
+def cholesky_solve(L, b):
+    """Solves L L^T x = b given the lower triangular Cholesky factor L"""
+    return solve_triangular(L, solve_triangular(L, b, lower=True), lower=True, trans='T')
+
+
+def solve_triangular(L, b, lower=True, trans=0):
+    """Solves a triangular system, loading scipy on first use"""
+    return linalg.solve_triangular(L, b, lower=lower, trans=trans)
@@ -0,0 +1,45 @@
+"""
+Tests rank one Cholesky updates against refactorizing
+"""
+from analytics.bandit.cholesky import cholesky_update, cholesky_solve
+import numpy as np
+
+
+def new_factor(d=6, seed=0):
+    random = np.random.RandomState(seed)
+    a = random.normal(size=(d, d))
+    precision = np.dot(a, a.T) + np.eye(d)
+    return precision, np.linalg.cholesky(precision), random.normal(size=d)
+
+
+def test_update():
+    precision, L, x = new_factor()
+    assert np.allclose(cholesky_update(L, x), np.linalg.cholesky(precision + np.outer(x, x)))
+
+
+def test_downdate():
+    precision, L, x = new_factor()
+    assert np.allclose(cholesky_update(cholesky_update(L, x), x, downdate=True), L)
+
+
+def test_downdate_not_positive_definite():
+    __, L, x = new_factor()
+    try:
+        cholesky_update(L, x * 100, downdate=True)
+    except np.linalg.LinAlgError:
+        pass
+    else:
+        raise AssertionError('downdate past positive definite did not raise')
+
+
+def test_solve():
+    precision, L, x = new_factor()
+    assert np.allclose(cholesky_solve(L, x), np.linalg.solve(precision, x))
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
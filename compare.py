@@ -0,0 +1,157 @@
+"""Compares the posterior distributions of arms by streaming posterior samples in chunks"""
+
+import numpy as np
+from multiprocessing import Pool
+from analytics.bandit.arm import Arm
+from analytics.bandit.lazy import LazyModule
+from analytics.bandit.sketch import QuantileSketch, DEFAULT_SKETCH_SIZE
+
+pd = LazyModule('pandas')
+
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_QUANTILES = (.025, .5, .975)
+DEFAULT_TOP_SAMPLES = 10000
+
+
+class PosteriorComparison(object):
+    """Accumulates the number of wins, the expected loss and quantile sketches of the posterior
+    samples of k arms. Memory is constant in the number of samples and comparisons built from
+    separate chunks of samples can be merged."""
+
+    def __init__(self, k, sketch_size=DEFAULT_SKETCH_SIZE):
+        self.k = k
+        self.n = 0
+        self.wins = np.zeros(k)
+        self.loss = np.zeros(k)
+        self.sketches = [QuantileSketch(sketch_size) for _ in xrange(k)]
+
+    def update(self, samples):
+        """Adds a chunk of samples with one row per draw and one column per arm"""
+        best = np.argmax(samples, axis=1)
+        self.wins += np.bincount(best, minlength=self.k)
+        self.loss += (samples[np.arange(len(samples)), best][:, None] - samples).sum(axis=0)
+        for i in xrange(self.k):
+            self.sketches[i].update(samples[:, i])
+        self.n += len(samples)
+        return self
+
+    def merge(self, other):
+        """Merges the comparison of another set of samples into this one"""
+        self.n += other.n
+        self.wins += other.wins
+        self.loss += other.loss
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+        return self
+
+    def get_report(self, names=None, quantiles=DEFAULT_QUANTILES):
+        """Returns the probability of being best, expected loss and posterior quantiles per arm"""
+        report = pd.DataFrame({'p_best': self.wins / self.n, 'expected_loss': self.loss / self.n},
+                              columns=['p_best', 'expected_loss'])
+        for q in quantiles:
+            report['q{}'.format(q)] = [sketch.quantile(q) for sketch in self.sketches]
+        if names is not None:
+            report.index = names
+        return report
+
+
+def sample_top(arm, stats, m, n_samples=DEFAULT_TOP_SAMPLES, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Returns each arm's posterior probability of being among the m best, its expected shortfall
+    from the m-th best mean and its expected shortfall from the best mean, from a k by s array of
+    the sufficient statistics of the arms. The top m of every draw are found with argpartition."""
+    k = len(stats)
+    m = min(m, k)
+    in_top = np.zeros(k)
+    loss = np.zeros(k)
+    best_loss = np.zeros(k)
+    drawn = 0
+    while drawn < n_samples:
+        n = min(chunk_size, n_samples - drawn)
+        samples = np.empty((n, k))
+        for i in xrange(k):
+            samples[:, i] = arm.sample_stats(stats[i], n)
+        top = np.argpartition(-samples, m - 1, axis=1)[:, :m]
+        in_top += np.bincount(top.ravel(), minlength=k)
+        threshold = samples[np.arange(n)[:, None], top].min(axis=1)
+        loss += np.maximum(threshold[:, None] - samples, 0).sum(axis=0)
+        best_loss += (samples.max(axis=1)[:, None] - samples).sum(axis=0)
+        drawn += n
+    return in_top / drawn, loss / drawn, best_loss / drawn
+
+
+def rank_top(arm, stats, m, n_samples=DEFAULT_TOP_SAMPLES, chunk_size=DEFAULT_CHUNK_SIZE,
+             names=None):
+    """Returns a dataframe ranking the arms by their probability of being among the m best, then
+    by their expected loss to the best arm, with the m best flagged as the whitelist.
+    expected_loss is measured from the m-th best arm and best_loss from the best arm."""
+    p_top, loss, best_loss = sample_top(arm, stats, m, n_samples, chunk_size)
+    rank = np.empty(len(stats), dtype=int)
+    rank[np.lexsort((best_loss, -p_top))] = np.arange(1, len(stats) + 1)
+    report = pd.DataFrame({'p_top': p_top, 'expected_loss': loss, 'best_loss': best_loss,
+                           'rank': rank, 'whitelist': rank <= m},
+                          columns=['p_top', 'expected_loss', 'best_loss', 'rank', 'whitelist'])
+    if names is not None:
+        report.index = names
+    return report.sort_values('rank')
+
+
+def sample_comparison(arms, data, n_samples, chunk_size, sketch_size, seed=None):
+    """Draws n_samples posterior samples per arm in chunks of chunk_size and accumulates them"""
+    if seed is not None:
+        np.random.seed(seed)
+    k = len(arms)
+    comparison = PosteriorComparison(k, sketch_size)
+    while comparison.n < n_samples:
+        n = min(chunk_size, n_samples - comparison.n)
+        samples = np.empty((n, k))
+        for i in xrange(k):
+            samples[:, i] = arms[i].sample(data[i], n)
+        comparison.update(samples)
+    return comparison
+
+
+def _sample_comparison_job(args):
+    """Unpacks arguments for sample_comparison in a worker process"""
+    return sample_comparison(*args)
+
+
+def compare_arms(arms, data=None, n_samples=100000, chunk_size=DEFAULT_CHUNK_SIZE,
+                 quantiles=DEFAULT_QUANTILES, sketch_size=DEFAULT_SKETCH_SIZE, processes=None,
+                 names=None):
+    """Compares the posteriors of arms using n_samples samples per arm while only holding
+    chunk_size samples at a time, so very large sample counts run in constant memory.
+    arms - List of arms, or a single arm used to model every element of data.
+    data - Optional list with the data for each arm, otherwise each arm samples its own data.
+    processes - Number of worker processes to spread the chunks over. Runs in process if None.
+    Returns a dataframe of the probability of being best, expected loss and quantiles per arm."""
+
+    if isinstance(arms, Arm):
+        if data is None:
+            raise RuntimeError('compare_arms needs a list of arms when there is no data')
+        arms = [arms] * len(data)
+    if data is None:
+        data = [None] * len(arms)
+
+    if processes is None or processes <= 1:
+        comparison = sample_comparison(arms, data, n_samples, chunk_size, sketch_size)
+    else:
+        # every worker gets whole chunks and its own seed so their samples are independent
+        n_chunks = -(-n_samples // chunk_size)
+        chunks_per_job = np.full(processes, n_chunks // processes)
+        chunks_per_job[:n_chunks % processes] += 1
+        job_ends = np.minimum(np.cumsum(chunks_per_job) * chunk_size, n_samples)
+        samples_per_job = np.diff(np.concatenate([[0], job_ends]))
+        seeds = np.random.randint(2 ** 31 - 1, size=processes)
+        jobs = [(arms, data, int(n), chunk_size, sketch_size, seed)
+                for n, seed in zip(samples_per_job, seeds) if n > 0]
+        pool = Pool(processes)
+        try:
+            results = pool.map(_sample_comparison_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        comparison = results[0]
+        for result in results[1:]:
+            comparison.merge(result)
+
+    return comparison.get_report(names, quantiles)
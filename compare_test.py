@@ -0,0 +1,81 @@
+"""
+Tests chunked posterior comparisons of arms
+"""
+from analytics.bandit.arm import BinomialArm, NormalArm
+from analytics.bandit.arm_stats import summarize
+from analytics.bandit.bandit import TopBandit
+from analytics.bandit.compare import compare_arms, rank_top, sample_top
+from analytics.bandit.environment import Environment
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+
+MEANS = [1., 2., 3., 2.05]
+
+
+def test_compare_arms():
+    np.random.seed(0)
+    data = [np.repeat([1, 0], [10, 90]), np.repeat([1, 0], [50, 50])]
+    report = compare_arms(BinomialArm(), data, n_samples=20000, chunk_size=3000, names=['a', 'b'])
+    assert list(report.index) == ['a', 'b']
+    assert abs(report.p_best.sum() - 1.) < 1e-9 and report.p_best['b'] > .99
+    assert report.expected_loss['a'] > .3 and report.expected_loss['b'] < .01
+
+
+def test_compare_arms_without_data():
+    try:
+        compare_arms(BinomialArm(), n_samples=100)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('compared a single arm without data')
+    arms = [BinomialArm(np.repeat([1, 0], [10, 90])), BinomialArm(np.repeat([1, 0], [50, 50]))]
+    assert compare_arms(arms, n_samples=1000).p_best[1] > .99
+
+
+def new_stats(means=MEANS, n=1000):
+    return np.array([summarize(np.random.normal(mean, 1., n)) for mean in means])
+
+
+def test_sample_top():
+    np.random.seed(0)
+    p_top, loss, best_loss = sample_top(NormalArm(), new_stats(), 2, n_samples=5000,
+                                        chunk_size=2000)
+    assert abs(p_top.sum() - 2.) < 1e-9
+    assert p_top[0] == 0. and p_top[2] == 1. and 0 < p_top[1] < 1 and 0 < p_top[3] < 1
+    assert loss[2] == 0. and abs(loss[0] - 1.) < .1
+    assert best_loss[2] < .01 and abs(best_loss[0] - 2.) < .1
+
+
+def test_rank_ties():
+    np.random.seed(0)
+    # both better arms are always in the top 2, so p_top ties and the best arm ranks first
+    report = rank_top(NormalArm(), new_stats(MEANS[:3]), 2, n_samples=2000, names=['a', 'b', 'c'])
+    assert list(report.index) == ['c', 'b', 'a']
+    assert list(report.p_top) == [1., 1., 0.] and (report.expected_loss[['b', 'c']] == 0).all()
+    assert list(report.whitelist) == [True, True, False]
+    assert list(report['rank']) == [1, 2, 3]
+
+
+def test_top_bandit():
+    np.random.seed(0)
+    run_date = date(2017, 4, 2)
+    day = run_date - timedelta(days=1)
+    data = [pd.Series(np.random.normal(mean, 1., 1000), index=[day] * 1000) for mean in MEANS]
+    env = Environment(4, TopBandit(m=2, n_samples=2000), NormalArm(), start_date=day,
+                      run_date=run_date, data=data, batch=1000)
+    env.allocation = env.calculate_allocation()
+    counts = np.bincount(env.allocation, minlength=4)
+    assert counts.sum() == 1000 and counts[0] == 0 and counts[2] == 500
+    assert list(env.bandit.report.index) == range(4)
+    whitelist = env.get_whitelist(2, n_samples=2000)
+    assert whitelist.index[0] == '2' and whitelist.whitelist.sum() == 2
+    assert set(whitelist.index[whitelist.whitelist]) < {'1', '2', '3'}
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
@@ -0,0 +1,120 @@
+"""
+Tests daily crm bandits of several metrics of one test sharing a query
+"""
+from analytics.bandit import bandit_crm
+from analytics.bandit.arm import BinomialArm, NormalArm
+from analytics.bandit.bandit import BayesianBandit
+from analytics.bandit.bandit_crm import BanditCRM, run_metrics, POST_BATCH_SIZE
+from analytics.bandit.environment import parse_allocation
+from datetime import date, timedelta
+import contextlib
+import cPickle as pickle
+import numpy as np
+import pandas as pd
+import shutil
+import tempfile
+
+START_DATE = date(2017, 6, 1)
+SHARDS = {'a': .2, 'b': .4}
+TABLES = {}
+
+
+class FakeConnection(object):
+    """Stands in for a redshift connection and its cursor"""
+
+    def __init__(self):
+        self.cur = None
+        self.conn = self
+
+    def commit(self):
+        pass
+
+
+class FakeRedshift(object):
+    """Stands in for the redshift module"""
+
+    @staticmethod
+    @contextlib.contextmanager
+    def managed_db_conn():
+        yield FakeConnection()
+
+
+class FakeWriter(object):
+    """Stands in for RedshiftDictWriter"""
+
+    def __init__(self, columns, str_columns):
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def writerow(self, row):
+        self.rows.append(row)
+
+    def copy_to_table(self, cur, schema, table):
+        TABLES.setdefault(table, []).extend(self.rows)
+
+
+def fake_metrics_query(db, game, day, metrics):
+    """Returns a day of users per shard joining from START_DATE with a column per metric"""
+    rows = []
+    for d in xrange(5):
+        joined = START_DATE + timedelta(days=d)
+        for shard, p in sorted(SHARDS.items()):
+            for user in xrange(200):
+                rows.append(dict(shard=shard, date_joined=joined,
+                                 date=joined + timedelta(days=day),
+                                 retention=int(np.random.random() < p),
+                                 cumarpu=np.random.random() * p))
+    return pd.DataFrame(rows)[['shard', 'date_joined', 'date'] + list(metrics)]
+
+
+def new_report(metric, arm):
+    params = dict(k=2, bandit=BayesianBandit(), arm=arm, arm_names=sorted(SHARDS),
+                  start_date=START_DATE)
+    return BanditCRM(test_name='test', metric=metric, day=1, game='game', bandit_params=params,
+                     start_date=START_DATE, run_date=START_DATE + timedelta(days=7))
+
+
+def test_run_metrics():
+    np.random.seed(0)
+    directory = tempfile.mkdtemp()
+    fakes = dict(STORAGE_PATH=directory, redshift=FakeRedshift, RedshiftDictWriter=FakeWriter,
+                 crm_metrics_query=fake_metrics_query, get_udid_table=lambda *args: None)
+    originals = {name: getattr(bandit_crm, name) for name in fakes}
+    try:
+        for name, fake in fakes.iteritems():
+            setattr(bandit_crm, name, fake)
+        TABLES.clear()
+        reports = [new_report('retention', BinomialArm()), new_report('cumarpu', NormalArm())]
+        allocations = run_metrics(reports)
+        assert len(allocations) == 2 and reports[0].path != reports[1].path
+
+        for report, allocation in zip(reports, allocations):
+            with open(report.path, 'rb') as pickle_input:
+                env = pickle.load(pickle_input)
+            assert parse_allocation(env.get_allocation(sort=False), POST_BATCH_SIZE, 2) == \
+                allocation
+            performance = env.get_performance().set_index('name')
+            assert list(performance.len) == [1000, 1000]
+            mean = performance['mean']['b']
+            assert abs(mean - (.4 if report.metric == 'retention' else .2)) < .05
+
+        rows = pd.DataFrame(TABLES['crm2groupchanges'])
+        assert list(rows.group_name) == ['test', 'test'] and list(rows.sub_group) == ['a', 'b']
+        assert list(rows.allocation) == list(allocations[0])
+    finally:
+        for name, original in originals.iteritems():
+            setattr(bandit_crm, name, original)
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
@@ -5,7 +5,7 @@
 """Draws sample means from a log normal distribution"""
 
 from numpy import exp, log, mean
-from analytics.bandit.draw_mus_and_sigmas import draw_mus_and_sigmas
+from analytics.bandit.draw_mus_and_sigmas import draw_mus_and_sigmas, draw_mus_and_sigmas_from_stats
 
 
 def draw_log_normal_means(data, m0=0., k0=1., s_sq0=1., v0=1., n_samples=1000):
@@ -23,3 +23,13 @@ def draw_log_normal_means(data, m0=0., k0=1., s_sq0=1., v0=1., n_samples=1000):
     # transform into log-normal means
     log_normal_mean_samples = exp(mu_samples + sig_sq_samples / 2)
     return log_normal_mean_samples
+
+
+def draw_log_normal_means_from_stats(N, log_mean, log_SSD, m0=0., k0=1., s_sq0=1., v0=1.,
+                                     n_samples=1000):
+    """Same as draw_log_normal_means but from the number of data points and the mean and sum of
+    squared differences of the log of the data"""
+
+    mu_samples, sig_sq_samples = draw_mus_and_sigmas_from_stats(N, log_mean, log_SSD, m0, k0, s_sq0,
+                                                                v0, n_samples)
+    return exp(mu_samples + sig_sq_samples / 2)
@@ -5,8 +5,7 @@
 """Draws sample means from a normal distribution"""
 
 from numpy import sum, mean, size, sqrt, array
-from scipy.stats import norm, invgamma
-import timeit, time
+from numpy.random import gamma, normal
 
 
 def draw_mus_and_sigmas(data, m0=0., k0=1., s_sq0=1., v0=1., n_samples=1000):
@@ -26,9 +25,7 @@ def draw_mus_and_sigmas(data, m0=0., k0=1., s_sq0=1., v0=1., n_samples=1000):
 
     N = size(data)
     if N == 0:
-        mu_samples = norm.rvs(m0, scale=s_sq0, size=n_samples)
-        sig_sq_samples = (v0 * s_sq0 / 2) * invgamma.rvs(v0 / 2, size=n_samples)
-        return mu_samples, sig_sq_samples
+        return draw_mus_and_sigmas_from_stats(0, 0., 0., m0, k0, s_sq0, v0, n_samples)
 
     # find the mean of the data
 
@@ -37,6 +34,18 @@ def draw_mus_and_sigmas(data, m0=0., k0=1., s_sq0=1., v0=1., n_samples=1000):
     # sum of squared differences between data and mean
     SSD = sum((data - the_mean)**2)
 
+    return draw_mus_and_sigmas_from_stats(N, the_mean, SSD, m0, k0, s_sq0, v0, n_samples)
+
+
+def draw_mus_and_sigmas_from_stats(N, the_mean, SSD, m0=0., k0=1., s_sq0=1., v0=1.,
+                                   n_samples=1000):
+    """Same as draw_mus_and_sigmas but from the number of data points, their mean and their sum of
+    squared differences from the mean, so the raw data never needs to be kept"""
+    if N == 0:
+        mu_samples = normal(m0, s_sq0, size=n_samples)
+        sig_sq_samples = (v0 * s_sq0 / 2) / gamma(v0 / 2, size=n_samples)
+        return mu_samples, sig_sq_samples
+
     # combining the prior with the data - page 79 of Gelman et al.
     # to make sense of this note that
     # inv-chi-sq(v,s^2) = inv-gamma(v/2,(v*s^2)/2)
@@ -52,9 +61,9 @@ def draw_mus_and_sigmas(data, m0=0., k0=1., s_sq0=1., v0=1., n_samples=1000):
 
     # math_end = time.time()
     # thanks to wikipedia, we know that:
-    # if X ~ inv-gamma(a,1) then b*X ~ inv-gamma(a,b)
+    # if X ~ inv-gamma(a,1) then b*X ~ inv-gamma(a,b), and 1/X ~ gamma(a,1)
     # gamma_start = time.time()
-    sig_sq_samples = beta * invgamma.rvs(alpha, size=n_samples)
+    sig_sq_samples = beta / gamma(alpha, size=n_samples)
     # gamma_end = time.time()
 
     # 2) draw means from a normal conditioned on the drawn sigmas
@@ -62,7 +71,7 @@ def draw_mus_and_sigmas(data, m0=0., k0=1., s_sq0=1., v0=1., n_samples=1000):
     mean_norm = mN
     var_norm = sqrt(sig_sq_samples / kN)
     # norm_start = time.time()
-    mu_samples = norm.rvs(mean_norm, scale=var_norm, size=n_samples)
+    mu_samples = normal(mean_norm, var_norm, size=n_samples)
     # norm_end = time.time()
     # draw_end = time.time()
     # print 'draw: {}, math:{}, gamma_sample: {}, norm_sample: {}'.format(
@@ -0,0 +1,126 @@
+"""Computes the Thompson sampling allocations of many environments in one vectorized pass"""
+
+import numpy as np
+import pandas as pd
+from analytics.bandit.arm import BinomialArm, NormalArm, LogNormalArm, ZeroInflatedLogNormalArm
+from analytics.bandit.arm_stats import N, N_POS, SUM, SUM_SQ, LOG_SUM, LOG_SUM_SQ
+from analytics.bandit.bandit import BayesianBandit
+
+
+def get_priors(arms, names):
+    """Returns a dictionary of prior name to a tests by 1 by 1 array of that prior for each arm"""
+    return {name: np.array([getattr(arm, name) for arm in arms], dtype=float)[:, None, None]
+            for name in names}
+
+
+def draw_normal_posteriors(n, total, total_sq, priors, size):
+    """Draws posterior samples of the mean and variance of normal rewards for arrays of counts,
+    sums and sums of squares, following draw_mus_and_sigmas_from_stats"""
+    m0, k0, s_sq0, v0 = priors['m0'], priors['k0'], priors['s_sq0'], priors['v0']
+    the_mean = total / np.where(n > 0, n, 1)
+    ssd = np.maximum(total_sq - n * the_mean ** 2, 0)
+
+    kN = k0 + n
+    mN = (k0 / kN) * m0 + (n / kN) * the_mean
+    vN = v0 + n
+    vN_times_s_sqN = v0 * s_sq0 + ssd + (n * k0 * (m0 - the_mean) ** 2) / kN
+
+    sig_sq = (vN_times_s_sqN / 2) / np.random.gamma(vN / 2, size=size)
+    mu = np.random.normal(mN, np.sqrt(sig_sq / kN), size=size)
+
+    # arms without rewards are drawn straight from the prior
+    prior_sig_sq = (v0 * s_sq0 / 2) / np.random.gamma(v0 / 2, size=size)
+    prior_mu = np.random.normal(m0, s_sq0, size=size)
+    empty = n == 0
+    return np.where(empty, prior_mu, mu), np.where(empty, prior_sig_sq, sig_sq)
+
+
+def sample_binomial(arms, stats, size):
+    """Posterior samples of a tests by arms by draws array of binomial arms"""
+    priors = get_priors(arms, ['alpha', 'beta'])
+    successes = stats[..., N_POS, None]
+    total = stats[..., N, None]
+    return np.random.beta(priors['alpha'] + successes, priors['beta'] + total - successes, size)
+
+
+def sample_normal(arms, stats, size):
+    """Posterior samples of a tests by arms by draws array of normal arms"""
+    priors = get_priors(arms, ['m0', 'k0', 's_sq0', 'v0'])
+    mu, __ = draw_normal_posteriors(stats[..., N, None], stats[..., SUM, None],
+                                    stats[..., SUM_SQ, None], priors, size)
+    return mu
+
+
+def sample_log_normal(arms, stats, size):
+    """Posterior samples of a tests by arms by draws array of log normal arms"""
+    priors = get_priors(arms, ['m0', 'k0', 's_sq0', 'v0'])
+    mu, sig_sq = draw_normal_posteriors(stats[..., N_POS, None], stats[..., LOG_SUM, None],
+                                        stats[..., LOG_SUM_SQ, None], priors, size)
+    return np.exp(mu + sig_sq / 2)
+
+
+def sample_zero_inflated_log_normal(arms, stats, size):
+    """Posterior samples of a tests by arms by draws array of zero inflated log normal arms"""
+    return sample_binomial(arms, stats, size) * sample_log_normal(arms, stats, size)
+
+
+BATCH_SAMPLERS = {
+    BinomialArm: sample_binomial,
+    NormalArm: sample_normal,
+    LogNormalArm: sample_log_normal,
+    ZeroInflatedLogNormalArm: sample_zero_inflated_log_normal,
+}
+
+
+def can_batch(env):
+    """Returns True if the environment's allocation can be computed by the batched engine"""
+    return (type(env.bandit) is BayesianBandit and env.bandit.tolerance is None and
+            type(env.arm) in BATCH_SAMPLERS and not env.data_empty())
+
+
+def allocate_batch(envs, min_size=None, run_dates=None):
+    """Computes a new Thompson sampling allocation for every environment, grouping environments
+    by arm type so each group is sampled in one vectorized pass, then finishes their cycles like
+    run_cycle. Returns the list of allocations.
+    min_size - Arms with less data than min_size get no allocation. Environments where no arm has
+    min_size keep their previous allocation.
+    run_dates - Run date of each environment's next cycle, one past its latest data by default."""
+    allocations = [None] * len(envs)
+
+    groups = {}
+    for i, env in enumerate(envs):
+        if can_batch(env):
+            groups.setdefault(type(env.arm), []).append(i)
+        else:
+            if not env.data_empty():
+                env.allocation = env.calculate_allocation(min_size=min_size)
+            allocations[i] = env.allocation
+
+    for arm_type, indexes in groups.iteritems():
+        group = [envs[i] for i in indexes]
+        k = max(env.k for env in group)
+        batch = max(env.batch for env in group)
+
+        stats = np.zeros((len(group), k, len(group[0].arm.summarize([]))))
+        valid = np.zeros((len(group), k), dtype=bool)
+        for t, env in enumerate(group):
+            stats[t, :env.k] = env.bandit.get_stats(env.k, env.arm, env.arm_states, env.run_date,
+                                                    env.sliding_window)
+            valid[t, :env.k] = True
+            if min_size is not None:
+                valid[t, :env.k] &= np.array([len(state) >= min_size for state in env.arm_states])
+
+        samples = BATCH_SAMPLERS[arm_type]([env.arm for env in group], stats,
+                                           (len(group), k, batch))
+        samples[~valid] = -np.inf
+        best = np.argmax(samples, axis=1)
+
+        for t, env in enumerate(group):
+            if valid[t].any():
+                env.allocation = pd.Series(best[t, :env.batch])
+            allocations[indexes[t]] = env.allocation
+
+    for i, env in enumerate(envs):
+        env.finish_cycle(run_date=run_dates[i] if run_dates is not None else None)
+
+    return allocations
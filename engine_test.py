@@ -0,0 +1,67 @@
+"""
+Tests batched allocations against the sequential run_cycle path
+"""
+from analytics.bandit.arm import BinomialArm
+from analytics.bandit.bandit import BayesianBandit
+from analytics.bandit.engine import allocate_batch
+from analytics.bandit.environment import Environment
+from analytics.bandit.snapshot import Snapshot
+from datetime import date, timedelta
+import numpy as np
+import os.path
+import pandas as pd
+import shutil
+import tempfile
+
+RUN_DATE = date(2017, 4, 10)
+
+
+def new_environment(snapshot_path=None):
+    return Environment(2, BayesianBandit(), BinomialArm(), start_date=date(2017, 4, 1),
+                       run_date=RUN_DATE, batch=1000, sliding_window=1,
+                       snapshot_path=snapshot_path)
+
+
+def new_data():
+    day = RUN_DATE - timedelta(days=1)
+    return [pd.Series(np.repeat([1, 0], [900, 100]), index=[day] * 1000),
+            pd.Series(np.repeat([1, 0], [100, 900]), index=[day] * 1000)]
+
+
+def test_batch_matches_run_cycle():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'snapshot')
+        sequential, batched = new_environment(), new_environment(path)
+        next_date = RUN_DATE + timedelta(days=1)
+        sequential.run_cycle(run_date=next_date, new_data=new_data())
+        batched.run_cycle(run_date=next_date, new_data=new_data(), allocate=False)
+        assert batched.run_date == RUN_DATE
+        allocate_batch([batched], run_dates=[next_date])
+        assert os.path.isfile(path)
+        names = Snapshot(path).names
+    finally:
+        shutil.rmtree(directory)
+    assert batched.run_date == sequential.run_date == next_date
+    assert list(names) == batched.get_arm_names()
+    assert (batched.allocation == 0).all() and (sequential.allocation == 0).all()
+
+
+def test_batch_without_arms_of_min_size():
+    batched, sequential = new_environment(), new_environment()
+    previous = batched.allocation.copy()
+    for env in (batched, sequential):
+        env.run_cycle(run_date=RUN_DATE + timedelta(days=1), new_data=new_data(), allocate=False)
+    allocate_batch([batched], min_size=2000)
+    assert batched.allocation.equals(previous)
+    assert sequential.calculate_allocation(min_size=2000).equals(previous)
+    allocate_batch([batched], min_size=1000)
+    assert (batched.allocation == 0).all()
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
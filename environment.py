@@ -6,10 +6,17 @@
 
 import numpy as np
 # import seaborn as sns
-import scipy.stats as stats
-import pandas as pd
+from copy import deepcopy
 from datetime import timedelta, date
-from analytics.bandit.arm import BinomialArm
+from analytics.bandit.arm import BinomialArm, LinearArm
+from analytics.bandit.arm_stats import ArmState, moments, summarize_by_day
+from analytics.bandit.compare import rank_top, DEFAULT_TOP_SAMPLES
+from analytics.bandit.lazy import LazyModule
+from analytics.bandit.observations import ObservationStore
+from analytics.bandit.sketch import QuantileSketch
+from analytics.bandit.snapshot import write_snapshot
+
+pd = LazyModule('pandas')
 
 DEFAULT_BATCH_SIZE = 1000
 
@@ -28,36 +35,112 @@ def equal_allocation(k, batch):
     return pd.Series(allocation)
 
 
-def get_binom_test_data(run_date, k, binom_ps, allocation, data=None):
-    """get test data for running experiments"""
-
-    data = [None] * k
-    for i in xrange(k):
-
-        if i not in allocation.value_counts().index:
-            continue
-        pulls = allocation.value_counts(sort=False)[i]
-        temp_data = np.random.binomial(1, binom_ps[i], pulls)
-        temp_dates = np.repeat(run_date, pulls)
-        data[i] = pd.Series(temp_data, index=temp_dates)
-
+def split_test_data(run_date, values, counts):
+    """Splits rewards drawn for all arms at once, ordered by arm, into a series per arm indexed by
+    run_date, with None for arms without pulls"""
+    data = [None] * len(counts)
+    for i, arm_values in enumerate(np.split(values, np.cumsum(counts)[:-1])):
+        if counts[i] > 0:
+            data[i] = pd.Series(arm_values, index=np.repeat(run_date, counts[i]))
     return data
 
 
-def get_normal_test_data(run_date, k, mus, sigmas, allocation):
+def get_binom_test_data(run_date, k, binom_ps, allocation, data=None):
     """get test data for running experiments"""
+    counts = np.bincount(allocation, minlength=k)
+    values = np.random.binomial(1, np.repeat(binom_ps, counts))
+    return split_test_data(run_date, values, counts)
 
-    data = [None] * k
-    for i in xrange(k):
 
-        if i not in allocation.value_counts().index:
-            continue
-        pulls = allocation.value_counts(sort=False)[i]
-        temp_data = np.random.normal(mus[i], sigmas[i], pulls)
-        temp_dates = np.repeat(run_date, pulls)
-        data[i] = pd.Series(temp_data, index=temp_dates)
-
-    return data
+def get_normal_test_data(run_date, k, mus, sigmas, allocation):
+    """get test data for running experiments"""
+    counts = np.bincount(allocation, minlength=k)
+    values = np.random.normal(np.repeat(mus, counts), np.repeat(sigmas, counts))
+    return split_test_data(run_date, values, counts)
+
+
+def take_pulls(values, counts):
+    """Returns the first counts[i] values of row i of values for every arm, ordered by arm"""
+    return np.concatenate([values[i, :count] for i, count in enumerate(counts)])
+
+
+class Scenario(object):
+    """Synthetic rewards for benchmarking policies, given to environments as test_vars['scenario'].
+    It holds no state, so one scenario can be shared by many environments.
+    reward - One of 'binomial', 'normal', 'lognormal' or 'zero_inflated_lognormal'.
+    mus, sigmas - Mean and standard deviation of each arm, of the log for log normal rewards.
+    ps - Probability of a reward of 1, or of a positive reward for zero inflated rewards.
+    drift - Change in each arm's mus, or ps for binomial rewards, per cycle.
+    seasonality - Factors multiplying the mean reward, cycling one per day.
+    delay - Days until a reward is observed, like day N retention."""
+
+    def __init__(self, reward='binomial', mus=None, sigmas=None, ps=None, drift=None,
+                 seasonality=None, delay=0):
+        if reward not in ('binomial', 'normal', 'lognormal', 'zero_inflated_lognormal'):
+            raise RuntimeError('Unknown reward type {}'.format(reward))
+        self.reward = reward
+        self.mus = np.asarray(mus, dtype=float) if mus is not None else None
+        self.sigmas = np.asarray(sigmas, dtype=float) if sigmas is not None else None
+        self.ps = np.asarray(ps, dtype=float) if ps is not None else None
+        self.drift = np.asarray(drift, dtype=float) if drift is not None else None
+        self.seasonality = np.asarray(seasonality, dtype=float) if seasonality is not None \
+            else None
+        self.delay = delay
+
+    def __str__(self):
+        return '{} scenario'.format(self.reward)
+
+    def get_params(self, cycle=0):
+        """Returns the ps, mus and sigmas of each arm at a cycle after drift and seasonality"""
+        ps, mus = self.ps, self.mus
+        if self.drift is not None:
+            if self.reward == 'binomial':
+                ps = ps + self.drift * cycle
+            else:
+                mus = mus + self.drift * cycle
+        if self.seasonality is not None:
+            factor = self.seasonality[cycle % len(self.seasonality)]
+            if self.reward == 'binomial':
+                ps = ps * factor
+            elif self.reward == 'normal':
+                mus = mus * factor
+            else:
+                mus = mus + np.log(factor)
+        if ps is not None:
+            ps = np.clip(ps, 0, 1)
+        return ps, mus, self.sigmas
+
+    def get_means(self, cycle=0):
+        """Returns the true mean reward of each arm at a cycle"""
+        ps, mus, sigmas = self.get_params(cycle)
+        if self.reward == 'binomial':
+            return ps
+        if self.reward == 'normal':
+            return mus
+        means = np.exp(mus + sigmas ** 2 / 2)
+        return means * ps if self.reward == 'zero_inflated_lognormal' else means
+
+    def draw(self, counts, cycle=0, uniforms=None, normals=None):
+        """Returns the rewards of counts pulls of each arm, ordered by arm
+        uniforms, normals - Shared random numbers with a row per arm, drawn if not given."""
+        n = counts.sum()
+        uniforms = np.random.random(n) if uniforms is None else take_pulls(uniforms, counts)
+        ps, mus, sigmas = self.get_params(cycle)
+        if self.reward == 'binomial':
+            return (uniforms < np.repeat(ps, counts)).astype(int)
+        normals = np.random.normal(size=n) if normals is None else take_pulls(normals, counts)
+        values = np.repeat(mus, counts) + np.repeat(sigmas, counts) * normals
+        if self.reward == 'normal':
+            return values
+        values = np.exp(values)
+        if self.reward == 'zero_inflated_lognormal':
+            values *= uniforms < np.repeat(ps, counts)
+        return values
+
+    def get_test_data(self, run_date, k, allocation, cycle=0, uniforms=None, normals=None):
+        """Draws the rewards of an allocation of the first k arms joining on run_date"""
+        counts = np.bincount(allocation, minlength=len(self.get_means()))
+        return split_test_data(run_date, self.draw(counts, cycle, uniforms, normals), counts)[:k]
 
 
 def parse_allocation(allocation, batch, precision=0):
@@ -90,16 +173,48 @@ class Environment(object):
 
     def __init__(self, k, bandit, arm, arm_names=None, start_date=None, run_date=None, data=None,
                  sliding_window=None, batch=None, allocation=None, label='Multi-Armed Bandit',
-                 test_vars=None, print_progress=None):
+                 test_vars=None, print_progress=None, half_life=None, keep_data=None,
+                 change_detector=None, snapshot_path=None, sketch_size=None, reward_dtype=None):
+        """half_life - Discounts the arms' statistics by half every half_life cycles instead of
+        using a sliding window. Only constant state is kept per arm.
+        keep_data - Keeps the raw data of each arm, stored compactly in an ObservationStore.
+            Defaults to True unless half_life is set.
+        change_detector - A ChangeDetector copied to every arm. When it detects a change, the arm's
+        statistics are truncated to the rewards since the change.
+        snapshot_path - Publishes every new allocation as a memory mapped snapshot to this path.
+        sketch_size - Keeps quantile sketches of this size of each arm's rewards per day within
+            the sliding window, since the last change and for its lifetime, so performance reports
+            can include quantiles in bounded memory.
+        reward_dtype - Type the raw rewards are kept as, such as np.float32 to halve their memory.
+            Defaults to int8 for binomial arms and float64 otherwise."""
+        if half_life is not None and sliding_window is not None:
+            raise RuntimeError('Use either a sliding window or a half life, not both')
         self.start_date = start_date if start_date is not None else date.today()
         self.run_date = run_date if run_date is not None else self.start_date
         self.k = k
         self.bandit = bandit
         self.arm = arm
         self.arm_names = arm_names if arm_names is not None else map(str, range(self.k))
-        self.data = data if data is not None else [pd.Series()] * k
-        self.sw_data = self.data
         self.sliding_window = sliding_window
+        self.half_life = half_life
+        self.keep_data = keep_data if keep_data is not None else half_life is None
+        self.reward_dtype = reward_dtype
+        data = data if data is not None else [None] * k
+        self.arm_states = [self.new_arm_state(d) for d in data]
+        self.observations = [self.new_observations(d) for d in data]
+        self.sketch_size = sketch_size
+        self.day_sketches = [{} for _ in xrange(k)]
+        self.sketches = [self.new_sketch() for _ in xrange(k)]
+        self.current_sketches = [self.new_sketch() for _ in xrange(k)]
+        self.sketch_starts = [None] * k
+        if sketch_size is not None:
+            for i in xrange(k):
+                self.update_sketches(i, data[i])
+        self.change_detector = change_detector
+        self.change_detectors = [self.new_change_detector() for _ in xrange(k)]
+        self.change_points = []
+        self.snapshot_path = snapshot_path
+        self.snapshot_version = 0
         self.batch = batch if batch is not None else DEFAULT_BATCH_SIZE
         if allocation is None:
             allocation = equal_allocation(self.k, self.batch)
@@ -116,14 +231,145 @@ class Environment(object):
         self.label = label
         self.test_vars = test_vars
         self.print_progress = print_progress if print_progress is not None else False
+        self.pending_data = {}
+
+    def __setstate__(self, state):
+        """Rebuilds arm states for environments pickled before they were kept"""
+        self.__dict__.update(state)
+        self.__dict__.setdefault('half_life', None)
+        self.__dict__.setdefault('keep_data', True)
+        self.__dict__.setdefault('reward_dtype', None)
+        self.__dict__.setdefault('change_detector', None)
+        self.__dict__.setdefault('change_points', [])
+        self.__dict__.setdefault('snapshot_path', None)
+        self.__dict__.setdefault('snapshot_version', 0)
+        self.__dict__.setdefault('sketch_size', None)
+        self.__dict__.setdefault('pending_data', {})
+        self.__dict__.setdefault('day_sketches', [{} for _ in xrange(self.k)])
+        self.__dict__.setdefault('sketches', [None] * self.k)
+        self.__dict__.setdefault('current_sketches', [sketch.copy() if sketch is not None else None
+                                                      for sketch in self.sketches])
+        self.__dict__.setdefault('sketch_starts', [None] * self.k)
+        if 'change_detectors' not in state:
+            self.change_detectors = [None] * self.k
+        if 'arm_states' not in state:
+            self.arm_states = [self.new_arm_state(d) for d in state['data']]
+        if 'observations' not in state:
+            self.observations = [self.new_observations(d) for d in state['data']]
+        self.__dict__.pop('data', None)
+        self.__dict__.pop('sw_data', None)
+
+    @property
+    def data(self):
+        """The raw data of each arm as series indexed by the date it was collected"""
+        return [observations.to_series() for observations in self.observations]
+
+    def new_observations(self, data=None):
+        """Returns the store of an arm's raw data, left empty unless data is kept"""
+        dtype = self.reward_dtype
+        if dtype is None:
+            dtype = np.int8 if isinstance(self.arm, BinomialArm) else np.float64
+        return ObservationStore(data if self.keep_data else None, dtype)
+
+    def new_sketch(self):
+        """Returns an empty quantile sketch, or None if quantiles are not kept"""
+        return QuantileSketch(self.sketch_size) if self.sketch_size is not None else None
+
+    def update_sketches(self, i, data):
+        """Adds an arm's new rewards to the sketches of the days they were collected, folding the
+        days that left the sliding window into the arm's lifetime sketch and, if they are after
+        the last change, its current sketch"""
+        if self.sketch_size is None:
+            return
+        day_sketches = self.day_sketches[i]
+        for day, values in summarize_by_day(data, np.asarray):
+            day_sketches.setdefault(day, self.new_sketch()).update(values)
+        self.fold_sketches(i)
+
+    def fold_sketches(self, i):
+        """Folds the days of an arm's daily sketches that left the sliding window into its
+        lifetime sketch and, if they are after the last change, its current sketch"""
+        day_sketches = self.day_sketches[i]
+        for day in day_sketches.keys():
+            if day < self.run_date - timedelta(days=self.sliding_window or 0):
+                day_sketch = day_sketches.pop(day)
+                if self.sketch_starts[i] is None or day >= self.sketch_starts[i]:
+                    self.current_sketches[i].merge(day_sketch)
+                self.sketches[i].merge(day_sketch)
+
+    def reset_sketches(self, i, start_date):
+        """Restarts an arm's current sketch at a change point. Days already folded out of the
+        daily sketches cannot be recovered, so it starts at the first day still kept."""
+        if self.sketch_size is None:
+            return
+        self.sketch_starts[i] = start_date
+        self.current_sketches[i] = self.new_sketch()
+
+    def get_quantiles(self, i, quantiles, sliding_window=False):
+        """Returns the quantiles of an arm's rewards over its lifetime, or like get_stats within
+        the sliding window or since the last change. Quantiles are never discounted."""
+        if self.sketch_size is None:
+            raise RuntimeError('Quantiles need an environment created with a sketch size')
+        start_date = self.sketch_starts[i] if sliding_window else None
+        if sliding_window and self.sliding_window is not None:
+            sketch = self.new_sketch()
+            window_start = self.run_date - timedelta(days=self.sliding_window)
+            start_date = max(start_date, window_start) if start_date else window_start
+        elif sliding_window:
+            sketch = self.current_sketches[i].copy()
+        else:
+            sketch = self.sketches[i].copy()
+        for day, day_sketch in self.day_sketches[i].iteritems():
+            if start_date is None or day >= start_date:
+                sketch.merge(day_sketch)
+        return sketch.quantile(quantiles)
+
+    def new_arm_state(self, data=None):
+        """Returns the sufficient statistics of an arm's data bucketed by date"""
+        state = ArmState(self.arm.summarize([]), self.half_life)
+        return state.update(data, self.arm.summarize)
+
+    def new_change_detector(self):
+        """Returns a fresh copy of the change detector for an arm"""
+        return deepcopy(self.change_detector) if self.change_detector is not None else None
+
+    def update_arm(self, i, data):
+        """Adds new data to an arm's statistics one day at a time, truncating them whenever the
+        arm's change detector fires"""
+        state = self.arm_states[i]
+        detector = self.change_detectors[i]
+        for day, day_stats in summarize_by_day(data, self.arm.summarize):
+            state.add(day, day_stats)
+            if detector is not None and detector.update(day, day_stats):
+                state.truncate(detector.change_date, detector.segment)
+                self.reset_sketches(i, detector.change_date)
+                self.change_points.append((self.run_date, self.arm_names[i], detector.change_date))
+                if self.print_progress:
+                    print 'change detected for arm {} from {}'.format(self.arm_names[i],
+                                                                      detector.change_date)
+                detector.reset()
+
+    def add_data(self, new_data):
+        """Adds a list with new data for each arm without calculating a new allocation"""
+        for i in xrange(self.k):
+            if self.keep_data:
+                self.observations[i].append(new_data[i])
+            self.update_arm(i, new_data[i])
+            self.update_sketches(i, new_data[i])
+
+    def decay(self, cycles=1):
+        """Discounts the arms' statistics by the given number of cycles if a half life is used"""
+        for state in self.arm_states:
+            state.decay(cycles)
 
     def get_data(self, df=False):
         """Returns current data
         df returns data in dataframe format"""
         if df:
             data = pd.DataFrame()
+            series = self.data
             for i in xrange(self.k):
-                temp_dict = dict(value=self.data[i], date=self.data[i].index, shard=i,
+                temp_dict = dict(value=series[i], date=series[i].index, shard=i,
                                  name=self.arm_names[i])
                 temp_df = pd.DataFrame(temp_dict)
                 data = data.append(temp_df, ignore_index=True)
@@ -133,7 +379,7 @@ class Environment(object):
 
     def data_empty(self):
         """Returns true if there is no data in the bandit so far and false if there is any data"""
-        return all(d.empty for d in self.data)
+        return all(state.get_max_date() is None for state in self.arm_states)
 
     def get_run_date(self):
         """Returns environment's current run date"""
@@ -158,8 +404,8 @@ class Environment(object):
         if incremental:
             self.run_date = self.run_date + timedelta(days=1)
         else:
-            max_dates = [max(data.index) for data in self.data]
-            max_date = max(max_dates)
+            max_dates = [state.get_max_date() for state in self.arm_states]
+            max_date = max(d for d in max_dates if d is not None)
             self.run_date = max_date + timedelta(days=1)
 
     def get_allocation(self, allocation=None, count=True, sort=True, names=True):
@@ -183,53 +429,119 @@ class Environment(object):
 
             return allocation
 
-    def get_performance(self, sort=False, sliding_window=False, min_size=None):
+    def get_performance(self, sort=False, sliding_window=False, min_size=None, quantiles=None):
         """Returns performance of arms for the data
         sort: sorts final dataframe by length of data and mean
-        sliding_window: only calculates performance of data within the sliding window"""
-
-        data = pd.DataFrame()
-
-        for i in xrange(self.k):
-            temp_dict = dict(value=self.data[i], date=self.data[i].index, shard=i,
-                             name=self.arm_names[i])
-            temp_df = pd.DataFrame(temp_dict)
-            data = data.append(temp_df, ignore_index=True)
-
-        if sliding_window and self.sliding_window is not None:
-            data = data[
-                data['date'] >= self.run_date - timedelta(days=self.sliding_window)
-            ]
-
-        grouped = data.groupby(['shard', 'name'])
-        perf = grouped.agg([len, np.mean, np.std, stats.sem]).value
+        sliding_window: only calculates performance of data within the sliding window, or of the
+        discounted data if the environment uses a half life
+        quantiles: adds a q<quantile> column per quantile from the arms' quantile sketches. They
+        follow change points but are not discounted by a half life."""
+
+        perf = []
+        for i, state in enumerate(self.arm_states):
+            if sliding_window:
+                arm_stats = state.get_stats(self.run_date, self.sliding_window)
+            else:
+                arm_stats = state.stats
+            n, mean, ssd = moments(arm_stats)
+            if n == 0:
+                continue
+            std = np.sqrt(ssd / (n - 1)) if n > 1 else np.nan
+            perf.append(dict(shard=i, name=self.arm_names[i], len=n, mean=mean, std=std,
+                             sem=std / np.sqrt(n)))
+            if quantiles is not None:
+                values = self.get_quantiles(i, quantiles, sliding_window)
+                perf[-1].update(('q{}'.format(q), x) for q, x in zip(quantiles, values))
+
+        columns = ['shard', 'name', 'len', 'mean', 'std', 'sem']
+        if quantiles is not None:
+            columns += ['q{}'.format(q) for q in quantiles]
+        perf = pd.DataFrame(perf, columns=columns)
+        perf = perf.set_index('shard')
 
         if min_size is not None:
             perf = perf[perf.len >= min_size]
 
         if sort:
-            perf = perf.sort(['len', 'mean'], ascending=[False, False])
-
-        perf = perf.reset_index(level='name')
+            perf = perf.sort_values(['len', 'mean'], ascending=[False, False])
 
         return perf
 
-    def add_arm(self, name=None, data=None):
-        """Add a new arm to the bandit. Data must be a pandas series indexed by date collected."""
-
+    def get_whitelist(self, m, n_samples=DEFAULT_TOP_SAMPLES, sliding_window=True):
+        """Returns the arms ranked by their posterior probability of being among the m best, with
+        the expected loss of each and the m best flagged as the whitelist
+        sliding_window: only uses the data within the sliding window, or since the last change"""
+        window = self.sliding_window if sliding_window else None
+        stats = np.array([state.get_stats(self.run_date, window) for state in self.arm_states])
+        return rank_top(self.arm, stats, m, n_samples, names=self.arm_names)
+
+    def publish_snapshot(self, path=None):
+        """Writes the current allocation weights and the count, mean, standard deviation and
+        standard error of the data the policy sees for each arm to a snapshot file"""
+        path = self.snapshot_path if path is None else path
+        counts = self.get_allocation(sort=False, names=False)
+        weights = counts.sort_index().values / float(counts.sum())
+
+        stats = []
+        for state in self.arm_states:
+            n, mean, ssd = moments(state.get_stats(self.run_date, self.sliding_window))
+            std = np.sqrt(ssd / (n - 1)) if n > 1 else np.nan
+            stats.append([n, mean, std, std / np.sqrt(n) if n > 0 else np.nan])
+
+        self.snapshot_version += 1
+        write_snapshot(path, self.arm_names, weights, stats, self.snapshot_version)
+
+    def merge_arm_states(self, states, features=None, day_sketches=None):
+        """Merges a dictionary of arm name to ArmState, such as the result of reduce_partitions,
+        into the environment's arms. Unknown arms are added. Raw data is not kept for merged states
+        and change detectors do not see them.
+        features - Dictionary of arm name to the feature row of unknown arms of a LinearArm
+        day_sketches - Dictionary of arm name to a dictionary of day to QuantileSketch, such as the
+        sketches of reduce_partitions, merged into the arms' daily sketches. Required to keep
+        quantiles of merged states."""
+        if day_sketches is not None and self.sketch_size is None:
+            raise RuntimeError('Merging sketches needs an environment created with a sketch size')
+        if day_sketches is None and self.sketch_size is not None:
+            raise RuntimeError('Merging states into an environment with a sketch size needs their '
+                               'day_sketches')
+        for name, state in states.iteritems():
+            if name not in self.arm_names:
+                self.add_arm(name=name, features=features[name] if features else None)
+            i = self.arm_names.index(name)
+            self.arm_states[i].merge(state)
+            if day_sketches is not None:
+                for day, sketch in day_sketches.get(name, {}).iteritems():
+                    if day in self.day_sketches[i]:
+                        self.day_sketches[i][day].merge(sketch)
+                    else:
+                        self.day_sketches[i][day] = sketch
+                self.fold_sketches(i)
+
+    def add_arm(self, name=None, data=None, features=None):
+        """Add a new arm to the bandit. Data must be a pandas series indexed by date collected.
+        features - Feature row of the new arm, required when the arm is a LinearArm"""
+
+        if isinstance(self.arm, LinearArm):
+            if features is None:
+                raise RuntimeError('Arms added to a LinearArm environment need a feature row')
+            self.arm.add_features(features)
         self.k += 1
         self.arm_names.append(name)
-        if data is None:
-            self.data.append(pd.Series())
-        else:
-            self.data.append(data)
+        self.observations.append(self.new_observations(data))
+        self.day_sketches.append({})
+        self.sketches.append(self.new_sketch())
+        self.current_sketches.append(self.new_sketch())
+        self.sketch_starts.append(None)
+        self.update_sketches(self.k - 1, data)
+        self.arm_states.append(self.new_arm_state(data))
+        self.change_detectors.append(self.new_change_detector())
 
     def calculate_allocation(self, data=None, run_date=None, sliding_window=None, n=None,
                              min_size=None):
         """Returns a new allocation of shards based on the current data"""
 
         # can customize variables for testing, otherwise use default
-        data = self.data if data is None else data
+        data = self.arm_states if data is None else data
         run_date = self.run_date if run_date is None else run_date
         sliding_window = self.sliding_window if sliding_window is None else sliding_window
         n = self.batch if n is None else n
@@ -237,10 +549,14 @@ class Environment(object):
         if min_size is not None:
             data_lengths = [len(i) for i in data]
             indexes = [i for i, length in enumerate(data_lengths) if length >= min_size]
+            if not indexes:
+                # no arm has enough data to compare yet, so keep the previous allocation
+                return self.allocation if len(self.allocation) == n else equal_allocation(self.k, n)
             k = len(indexes)
             filter_data = [data[i] for i in indexes]
-            allocation = self.bandit.select_arm(k, self.arm, filter_data, self.allocation,
-                                                self.start_date, run_date, sliding_window, n)
+            allocation = self.bandit.select_arm(k, self.arm.subset(indexes), filter_data,
+                                                self.allocation, self.start_date, run_date,
+                                                sliding_window, n)
             allocation = [indexes[i] for i in allocation]
             return pd.Series(allocation)
 
@@ -248,33 +564,61 @@ class Environment(object):
                                       run_date, sliding_window, n)
 
     def run_cycle(self, num_cycle=None, run_date=None, new_data=None, incremental=False,
-                  min_size=None):
+                  min_size=None, allocate=True):
         """Runs one cycle of the multi armed bandit experiment by using given data or pulling in
-        new data and determining new allocations"""
+        new data and determining new allocations
+        allocate: if False, only adds the new data, leaving the allocation and finish_cycle to be
+        done later, for example by allocate_batch"""
 
         if self.print_progress:
             print 'iteration: {}'.format(num_cycle)
             print self.get_allocation()
 
         if new_data is None:
-            if isinstance(self.arm, BinomialArm):
-                # binomial test
-                new_data = get_binom_test_data(self.run_date, self.k, self.test_vars['binom_ps'],
-                                               self.allocation)
-            else:
-                # normal test
-                new_data = get_normal_test_data(self.run_date, self.k, self.test_vars['mus'],
-                                                self.test_vars['sigmas'], self.allocation)
+            new_data = self.get_test_data()
 
-        for i in xrange(self.k):
-            self.data[i] = self.data[i].append(new_data[i])
+        self.decay()
+        self.add_data(new_data)
 
-        if not self.data_empty():
-            self.allocation = self.calculate_allocation(min_size=min_size)
-        self.update_run_date(run_date=run_date, incremental=incremental)
+        if allocate:
+            if not self.data_empty():
+                self.allocation = self.calculate_allocation(min_size=min_size)
+            self.finish_cycle(run_date=run_date, incremental=incremental)
 
         return self.allocation.value_counts(sort=False)
 
+    def finish_cycle(self, run_date=None, incremental=False):
+        """Updates the run date once the cycle's allocation is computed and publishes it"""
+        self.update_run_date(run_date=run_date, incremental=incremental)
+        if self.snapshot_path is not None:
+            self.publish_snapshot()
+
+    def get_cycle(self):
+        """Returns the number of days since the start date"""
+        return (self.run_date - self.start_date).days
+
+    def get_test_data(self, uniforms=None, normals=None):
+        """Draws the rewards of the current allocation from the test variables. Delayed scenario
+        rewards are held by the environment until the day they mature.
+        uniforms, normals - Shared random numbers for a scenario, with a row per arm."""
+        if 'scenario' in self.test_vars:
+            scenario = self.test_vars['scenario']
+            data = scenario.get_test_data(self.run_date, self.k, self.allocation,
+                                          self.get_cycle(), uniforms, normals)
+            if not scenario.delay:
+                return data
+            self.pending_data[self.run_date + timedelta(days=scenario.delay)] = data
+            data = self.pending_data.pop(self.run_date, [])
+            return data + [None] * (self.k - len(data))
+        elif isinstance(self.arm, BinomialArm):
+            # binomial test
+            return get_binom_test_data(self.run_date, self.k, self.test_vars['binom_ps'],
+                                       self.allocation)
+        else:
+            # normal test
+            return get_normal_test_data(self.run_date, self.k, self.test_vars['mus'],
+                                        self.test_vars['sigmas'], self.allocation)
+
     def run(self):
         """Runs cycles of the bandit until it reaches a stopping point given in test_vars
         Mainly used for testing"""
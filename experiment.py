@@ -7,50 +7,135 @@
 from analytics.bandit.arm import *
 from analytics.bandit.bandit import *
 from analytics.bandit.environment import *
+import cPickle as pickle
+import os.path
+
+DEFAULT_REGRET_PATH = 'regret_df.csv'
+DEFAULT_FLUSH_CYCLES = 10
+REGRET_COLUMNS = ['date', 'env', 'label', 'optimal', 'pulls', 'regret', 'reward']
+
+
+def get_true_means(env):
+    """Returns the true mean reward of each arm of a test environment at its run date"""
+    if 'scenario' in env.test_vars:
+        return env.test_vars['scenario'].get_means(env.get_cycle())
+    if isinstance(env.arm, BinomialArm):
+        return np.asarray(env.test_vars['binom_ps'], dtype=float)
+    return np.asarray(env.test_vars['mus'], dtype=float)
+
+
+def get_common_test_data(env, uniforms, normals):
+    """Gets test data from random numbers shared by all environments, so the j-th pull of arm i in
+    a cycle has the same outcome under every policy
+    uniforms, normals - arrays with a row per arm and a column per pull"""
+    if 'scenario' in env.test_vars:
+        return env.get_test_data(uniforms, normals)
+    counts = np.bincount(env.allocation, minlength=env.k)
+    data = [None] * env.k
+    for i in xrange(env.k):
+        if counts[i] == 0:
+            continue
+        if isinstance(env.arm, BinomialArm):
+            values = (uniforms[i, :counts[i]] < env.test_vars['binom_ps'][i]).astype(int)
+        else:
+            values = env.test_vars['mus'][i] + env.test_vars['sigmas'][i] * normals[i, :counts[i]]
+        data[i] = pd.Series(values, index=np.repeat(env.run_date, counts[i]))
+    return data
 
 
 class Experiment(object):
-    """Base class for measuring performance of multi armed bandit algorithms."""
+    """Base class for measuring performance of multi armed bandit algorithms
+    expected - Measures rewards as the allocation counts times the true means.
+    common_random_numbers - Shares each cycle's random outcomes across the environments.
+    path - Csv the regret rows are appended to every flush_cycles cycles.
+    checkpoint_path - Saves the experiment at every flush to resume an interrupted run."""
 
-    def __init__(self, environments, cycles):
+    def __init__(self, environments, cycles, expected=False, common_random_numbers=False,
+                 path=DEFAULT_REGRET_PATH, flush_cycles=DEFAULT_FLUSH_CYCLES,
+                 checkpoint_path=None):
         self.environments = environments
         self.cycles = cycles
+        self.expected = expected
+        self.common_random_numbers = common_random_numbers
+        self.path = path
+        self.flush_cycles = flush_cycles
+        self.checkpoint_path = checkpoint_path
+        self.cycle = 0
+        self.pulls = [0] * len(environments)
+        self.reward = [0.] * len(environments)
+        self.optimal = [0.] * len(environments)
+        self.offset = 0
 
     def __str__(self):
         return 'Experiment to test and measure effectiveness of multi arm bandit algorithms'
 
+    def get_new_data(self):
+        """Returns the new data of every environment for a cycle"""
+        if not self.common_random_numbers:
+            return [env.get_test_data() for env in self.environments]
+        k = max(env.k for env in self.environments)
+        batch = max(env.batch for env in self.environments)
+        uniforms = np.random.random((k, batch))
+        normals = np.random.normal(size=(k, batch))
+        return [get_common_test_data(env, uniforms, normals) for env in self.environments]
+
+    def run_environment(self, i, new_data, means):
+        """Runs a cycle of an environment and returns its regret row
+        means - True means of the arms in the cycle, taken before its data is drawn"""
+        env = self.environments[i]
+        counts = np.bincount(env.allocation, minlength=env.k)
+        self.pulls[i] += counts.sum()
+        self.optimal[i] += counts.sum() * means.max()
+        if self.expected:
+            self.reward[i] += np.dot(counts, means)
+        else:
+            self.reward[i] += sum(x.sum() for x in new_data if x is not None)
+        env.run_cycle(new_data=new_data, incremental=True)
+        bandit_date = env.get_run_date() - timedelta(days=1)
+        return dict(env=i, label=env.label, date=bandit_date, pulls=self.pulls[i],
+                    optimal=self.optimal[i], reward=self.reward[i],
+                    regret=self.optimal[i] - self.reward[i])
+
+    def flush(self, rows):
+        """Appends regret rows to the csv and checkpoints the experiment"""
+        with open(self.path, 'r+b' if self.offset else 'wb') as output:
+            output.seek(self.offset)
+            output.truncate()
+            pd.DataFrame(rows, columns=REGRET_COLUMNS).to_csv(output, header=self.offset == 0,
+                                                               index=False)
+            self.offset = output.tell()
+        if self.checkpoint_path is not None:
+            temp_path = self.checkpoint_path + '.tmp'
+            with open(temp_path, 'wb') as output:
+                pickle.dump((self, np.random.get_state()), output, -1)
+            os.rename(temp_path, self.checkpoint_path)
+
+    def resume(self):
+        """Restores the experiment from its checkpoint if there is one, keeping the number of
+        cycles to run"""
+        if self.checkpoint_path is None or not os.path.isfile(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, 'rb') as pickle_input:
+            experiment, random_state = pickle.load(pickle_input)
+        cycles = self.cycles
+        self.__dict__.update(experiment.__dict__)
+        self.cycles = cycles
+        np.random.set_state(random_state)
+        print 'resuming from cycle {}'.format(self.cycle)
+
     def run(self):
         """Function to run the various multi arm bandit experiments and output the results"""
-        n = len(self.environments)
-        optimal = [0] * n
-
-        regret_report = []
-
-        for i in xrange(n):
-            env = self.environments[i]
-            if isinstance(env.arm, BinomialArm):
-                temp_optimal = max(env.test_vars['binom_ps'])
-            else:
-                temp_optimal = max(env.test_vars['mus'])
-            optimal[i] = temp_optimal
-
-        for k in xrange(self.cycles):
-            print k
-            for i in xrange(n):
-                env = self.environments[i]
-                env.run_cycle()
-                perf = env.get_performance()
-                perf['reward'] = perf['len'] * perf['mean']
-                pulls = sum(perf['len'])
-                regret = optimal[i] * pulls - sum(perf['reward'])
-                bandit_date = env.get_run_date() - timedelta(days=1)
-
-                regret_report.append(dict(env=i, label=env.label, date=bandit_date, pulls=pulls,
-                                          optimal=optimal[i] * pulls, reward=sum(perf['reward']),
-                                          regret=regret))
-
-        regret_df = pd.DataFrame(regret_report)
-
-        regret_df.to_csv('regret_df.csv')
-
-        return regret_df
+        self.resume()
+        rows = []
+        while self.cycle < self.cycles:
+            print self.cycle
+            means = [get_true_means(env) for env in self.environments]
+            new_data = self.get_new_data()
+            rows.extend(self.run_environment(i, new_data[i], means[i])
+                        for i in xrange(len(self.environments)))
+            self.cycle += 1
+            if self.cycle % self.flush_cycles == 0 or self.cycle == self.cycles:
+                self.flush(rows)
+                rows = []
+
+        return pd.read_csv(self.path, parse_dates=['date'])
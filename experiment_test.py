@@ -0,0 +1,65 @@
+"""
+Tests regret tracking of experiments over synthetic scenarios
+"""
+from analytics.bandit.arm import NormalArm
+from analytics.bandit.bandit import BayesianBandit
+from analytics.bandit.environment import Environment, Scenario
+from analytics.bandit.experiment import Experiment
+from datetime import date
+import os.path
+import shutil
+import tempfile
+
+
+def new_environments(scenario, n=2):
+    return [Environment(2, BayesianBandit(), NormalArm(), start_date=date(2017, 4, 1), batch=100,
+                        test_vars=dict(scenario=scenario)) for _ in xrange(n)]
+
+
+def test_drifting_regret():
+    scenario = Scenario('normal', mus=[1., 1.], sigmas=[1., 1.], drift=[0., 1.])
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'regret.csv')
+        regret = Experiment(new_environments(scenario), 3, expected=True, path=path).run()
+    finally:
+        shutil.rmtree(directory)
+    first = regret[regret.date == regret.date.min()]
+    assert (first.regret == 0).all()
+    assert (first.optimal == 100).all()
+
+
+def test_common_scenario_data():
+    scenario = Scenario('normal', mus=[1., 2.], sigmas=[1., 1.])
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'regret.csv')
+        regret = Experiment(new_environments(scenario), 1, common_random_numbers=True,
+                            path=path).run()
+    finally:
+        shutil.rmtree(directory)
+    assert regret.reward.nunique() == 1
+
+
+def test_resume_cycles():
+    scenario = Scenario('normal', mus=[1., 2.], sigmas=[1., 1.])
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'regret.csv')
+        checkpoint_path = os.path.join(directory, 'experiment.pkl')
+        Experiment(new_environments(scenario), 3, path=path, flush_cycles=1,
+                   checkpoint_path=checkpoint_path).run()
+        regret = Experiment(new_environments(scenario), 5, path=path, flush_cycles=1,
+                            checkpoint_path=checkpoint_path).run()
+    finally:
+        shutil.rmtree(directory)
+    assert len(regret) == 10
+    assert regret.date.nunique() == 5
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
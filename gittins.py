@@ -0,0 +1,110 @@
+"""Precomputed Gittins index tables for beta-bernoulli arms"""
+
+import os
+import sys
+import numpy as np
+from multiprocessing import Pool
+
+TABLE_DIRECTORY = '/mnt/bandit'
+DEFAULT_DISCOUNT = .99
+DEFAULT_TABLE_SIZE = 200
+DEFAULT_GRID_SIZE = 512
+# indices are stored as 16 bit fractions of 1
+QUANTIZATION = 2 ** 16 - 1
+
+
+def get_table_path(discount, size, directory=TABLE_DIRECTORY):
+    """Returns the path of the table for a discount and size in directory"""
+    return os.path.join(directory, 'gittins_{}_{}.npy'.format(discount, size))
+
+
+def continuation_advantage(retirement, discount, size, horizon):
+    """Returns a size + 1 by size + 1 array of the value of continuing minus the value of retiring
+    for every beta state (a, b) with 1 <= a, b <= size, by backward induction over horizon pulls"""
+    retire = retirement / (1 - discount)
+    last = 2 * size + horizon
+    advantage = np.zeros((size + 1, size + 1))
+
+    # values of the states with a + b == n, indexed by a
+    a = np.arange(last + 1, dtype=float)
+    values = np.maximum(retire, a / last / (1 - discount))
+    for n in xrange(last - 1, 1, -1):
+        a = np.arange(1, n, dtype=float)
+        mean = a / n
+        cont = mean + discount * (mean * values[2:n + 1] + (1 - mean) * values[1:n])
+        values = np.concatenate([[0.], np.maximum(retire, cont), [0.]])
+
+        # keep the states inside the table
+        in_table = (a <= size) & (n - a <= size)
+        advantage[a[in_table].astype(int), (n - a[in_table]).astype(int)] = \
+            (cont - retire)[in_table]
+
+    return advantage
+
+
+def _continuation_advantage_job(args):
+    """Computes continuation advantages for a list of retirement rewards in a worker process"""
+    retirements, discount, size, horizon = args
+    return np.array([continuation_advantage(r, discount, size, horizon) for r in retirements])
+
+
+def generate_table(discount=DEFAULT_DISCOUNT, size=DEFAULT_TABLE_SIZE, path=None, horizon=None,
+                   grid_size=DEFAULT_GRID_SIZE, processes=None):
+    """Computes the Gittins index of every beta state (a, b) with 1 <= a, b <= size by calibration
+    against a grid of retirement rewards and saves it to path as 16 bit fractions. Run ahead of
+    time, as GittinsBandit never generates tables itself.
+    horizon - Number of pulls to look ahead, defaulting to ten times the effective horizon."""
+    path = get_table_path(discount, size) if path is None else path
+    horizon = int(10 / (1 - discount)) if horizon is None else horizon
+    grid = np.linspace(0, 1, grid_size)
+
+    jobs = [(chunk, discount, size, horizon) for chunk in np.array_split(grid, processes or 8)]
+    pool = Pool(processes)
+    try:
+        advantage = np.concatenate(pool.map(_continuation_advantage_job, jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+    # advantage decreases with the retirement reward, find the last grid point still above zero
+    last_above = np.clip((advantage >= 0).sum(axis=0) - 1, 0, grid_size - 2)
+    rows, cols = np.indices(last_above.shape)
+    above = advantage[last_above, rows, cols]
+    below = advantage[last_above + 1, rows, cols]
+    step = grid[1] - grid[0]
+    fraction = np.clip(above / np.where(above > below, above - below, 1), 0, 1)
+    index = grid[last_above] + fraction * step
+
+    table = np.round(np.clip(index, 0, 1) * QUANTIZATION).astype(np.uint16)
+    np.save(path, table)
+    return path
+
+
+def load_table(path):
+    """Memory maps a table saved by generate_table"""
+    return np.load(path, mmap_mode='r')
+
+
+def brezzi_lai_index(a, b, discount):
+    """Asymptotic approximation of the Gittins index of beta states from Brezzi and Lai (2002)"""
+    n = a + b
+    mean = a / n
+    std = np.sqrt(mean * (1 - mean) / (n + 1))
+    s = 1 / ((n + 1) * np.log(1 / discount))
+    with np.errstate(invalid='ignore'):
+        large_s = np.sqrt(np.maximum(2 * np.log(s) - np.log(np.log(s)) - np.log(16 * np.pi), 0))
+    psi = np.where(s <= .2, np.sqrt(s / 2),
+          np.where(s <= 1, .49 - .11 / np.sqrt(s),
+          np.where(s <= 5, .63 - .26 / np.sqrt(s),
+          np.where(s <= 15, .77 - .58 / np.sqrt(s), large_s))))
+    return np.minimum(mean + std * psi, 1)
+
+
+if __name__ == '__main__':
+
+    # python gittins.py [discount] [size] [directory]
+    DISCOUNT = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DISCOUNT
+    SIZE = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_TABLE_SIZE
+    DIRECTORY = sys.argv[3] if len(sys.argv) > 3 else TABLE_DIRECTORY
+
+    print 'Saved', generate_table(DISCOUNT, SIZE, get_table_path(DISCOUNT, SIZE, DIRECTORY))
@@ -0,0 +1,59 @@
+"""
+Tests the Gittins index tables and their fallback
+"""
+from analytics.bandit.arm import BinomialArm
+from analytics.bandit.arm_stats import ArmState, summarize
+from analytics.bandit.bandit import GittinsBandit
+from analytics.bandit.gittins import generate_table, load_table, brezzi_lai_index, QUANTIZATION
+from datetime import date
+import cPickle as pickle
+import logging
+import numpy as np
+import os
+import shutil
+import tempfile
+
+RUN_DATE = date(2017, 4, 1)
+
+
+def test_generate_table():
+    directory = tempfile.mkdtemp()
+    try:
+        table = np.array(load_table(generate_table(.9, 20, os.path.join(directory, 'g.npy'),
+                                                   processes=2))) / float(QUANTIZATION)
+    finally:
+        shutil.rmtree(directory)
+    # Gittins index of a uniform prior at a discount of .9
+    assert abs(table[1, 1] - .7029) < .002
+    assert (np.diff(table[1:, 1:], axis=0) > 0).all()
+    assert (np.diff(table[1:, 1:], axis=1) < 0).all()
+
+
+def test_missing_table():
+    directory = tempfile.mkdtemp()
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logging.getLogger().addHandler(handler)
+    try:
+        bandit = GittinsBandit(.9, 20, directory=directory)
+        state = ArmState(summarize([]))
+        state.add(RUN_DATE, summarize([1, 0, 0]))
+        for _ in xrange(3):
+            bandit.select_arm(1, BinomialArm(), [state], None, RUN_DATE, RUN_DATE, None, 10)
+        assert os.listdir(directory) == []
+    finally:
+        logging.getLogger().removeHandler(handler)
+        shutil.rmtree(directory)
+    assert len(records) == 1
+    assert not pickle.loads(pickle.dumps(bandit)).table_missing
+    a, b = np.array([1., 3.]), np.array([2., 5.])
+    assert np.allclose(bandit.get_indices(a, b), brezzi_lai_index(a, b, .9))
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
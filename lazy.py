@@ -0,0 +1,24 @@
+"""Lazily imported modules so the core bandit api starts with only numpy loaded"""
+
+import importlib
+
+
+class LazyModule(object):
+    """Stands in for a module and imports it on first attribute access, so heavy dependencies
+    like pandas are only paid for by the jobs that use them"""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __repr__(self):
+        return '<lazy module {}>'.format(self._name)
+
+    def load(self):
+        """Imports and returns the module"""
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
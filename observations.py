@@ -0,0 +1,82 @@
+"""Compact storage of the raw rewards of an arm"""
+
+import numpy as np
+from datetime import date
+from analytics.bandit.lazy import LazyModule
+
+pd = LazyModule('pandas')
+
+INITIAL_CAPACITY = 1024
+
+
+def to_ordinals(index):
+    """Returns the proleptic ordinals of an index of dates as int32, converting each distinct date
+    once"""
+    days, inverse = np.unique(np.asarray(index), return_inverse=True)
+    ordinals = np.array([pd.Timestamp(day).toordinal() for day in days], dtype=np.int32)
+    return ordinals[inverse]
+
+
+class ObservationStore(object):
+    """The raw rewards of an arm and their int32 day ordinals in arrays grown by doubling
+    dtype - Type of the rewards, such as int8 for binary rewards."""
+
+    def __init__(self, data=None, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.values = np.empty(0, dtype=self.dtype)
+        self.days = np.empty(0, dtype=np.int32)
+        self.size = 0
+        self.series = None
+        self.append(data)
+
+    def __len__(self):
+        return self.size
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['values'] = self.values[:self.size].copy()
+        state['days'] = self.days[:self.size].copy()
+        state['series'] = None
+        return state
+
+    def reserve(self, size):
+        """Grows the arrays to hold at least size rewards"""
+        if size <= len(self.values):
+            return
+        capacity = max(size, 2 * len(self.values), INITIAL_CAPACITY)
+        values = np.empty(capacity, dtype=self.dtype)
+        values[:self.size] = self.values[:self.size]
+        days = np.empty(capacity, dtype=np.int32)
+        days[:self.size] = self.days[:self.size]
+        self.values, self.days = values, days
+
+    def append(self, data):
+        """Appends a series of rewards indexed by the date they were collected"""
+        if data is None or len(data) == 0:
+            return
+        n = len(data)
+        self.reserve(self.size + n)
+        self.values[self.size:self.size + n] = np.asarray(data)
+        self.days[self.size:self.size + n] = to_ordinals(data.index)
+        self.size += n
+        self.series = None
+
+    def get_values(self):
+        """Returns a view of the rewards"""
+        return self.values[:self.size]
+
+    def get_days(self):
+        """Returns a view of the ordinals of the days the rewards were collected"""
+        return self.days[:self.size]
+
+    def to_series(self):
+        """Returns the rewards as a series indexed by date"""
+        if self.series is None:
+            ordinals, inverse = np.unique(self.get_days(), return_inverse=True)
+            dates = np.array([date.fromordinal(x) for x in ordinals], dtype=object)
+            self.series = pd.Series(self.get_values(), index=dates[inverse])
+        return self.series
+
+    def nbytes(self):
+        """Returns the bytes used by the stored rewards and days"""
+        return self.values.nbytes + self.days.nbytes
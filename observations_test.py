@@ -0,0 +1,95 @@
+"""
+Tests the compact raw reward store of the arms and its pickling
+"""
+from analytics.bandit.arm import BinomialArm, NormalArm
+from analytics.bandit.bandit import BayesianBandit
+from analytics.bandit.environment import Environment
+from analytics.bandit.observations import ObservationStore, INITIAL_CAPACITY
+from datetime import date, timedelta
+import cPickle as pickle
+import numpy as np
+import pandas as pd
+
+START_DATE = date(2017, 4, 1)
+
+
+def new_data(day, n, mean=0.):
+    return pd.Series(np.random.normal(mean, 1., n), index=[START_DATE + timedelta(days=day)] * n)
+
+
+def test_growth():
+    store = ObservationStore()
+    chunks = [new_data(day, n) for day, n in enumerate([10, INITIAL_CAPACITY, 3000])]
+    capacities = []
+    for chunk in chunks:
+        store.append(chunk)
+        capacities.append(len(store.values))
+    assert capacities == [INITIAL_CAPACITY, 2 * INITIAL_CAPACITY, 4 * INITIAL_CAPACITY]
+    assert len(store) == 10 + INITIAL_CAPACITY + 3000
+    assert np.array_equal(store.get_values(), np.concatenate(chunks))
+    store.append(None)
+    store.append(pd.Series([]))
+    assert len(store) == 10 + INITIAL_CAPACITY + 3000
+
+
+def test_to_series():
+    chunks = [new_data(day, 5) for day in (0, 2, 2, 7)]
+    store = ObservationStore(chunks[0])
+    for chunk in chunks[1:]:
+        store.append(chunk)
+    expected = pd.concat(chunks)
+    series = store.to_series()
+    assert store.to_series() is series
+    assert np.array_equal(series.values, expected.values)
+    assert list(series.index) == list(expected.index)
+    store.append(new_data(8, 1))
+    assert len(store.to_series()) == 21
+
+
+def test_pickle_trims():
+    store = ObservationStore(new_data(0, 10), dtype=np.float32)
+    store.to_series()
+    state = store.__getstate__()
+    assert len(state['values']) == len(state['days']) == 10 and state['series'] is None
+    copy = pickle.loads(pickle.dumps(store, -1))
+    assert copy.values.dtype == np.float32 and len(copy) == 10
+    assert np.array_equal(copy.get_values(), store.get_values())
+    copy.append(new_data(1, 5))
+    assert len(copy) == 15
+
+
+def test_reward_dtypes():
+    data = [new_data(0, 10, 1.), new_data(0, 10, 2.)]
+    binomial = Environment(2, BayesianBandit(), BinomialArm(), start_date=START_DATE,
+                           data=[(x > 1.5).astype(int) for x in data])
+    compact = Environment(2, BayesianBandit(), NormalArm(), start_date=START_DATE, data=data,
+                          reward_dtype=np.float32)
+    assert binomial.observations[0].values.dtype == np.int8
+    assert compact.observations[0].values.dtype == np.float32
+    assert np.allclose(compact.data[1].values, data[1].values)
+
+
+def test_old_pickle():
+    data = [new_data(0, 10, 1.), new_data(1, 10, 2.)]
+    env = Environment(2, BayesianBandit(), NormalArm(), start_date=START_DATE, data=data)
+    state = env.__dict__.copy()
+    for name in ('observations', 'arm_states', 'keep_data', 'reward_dtype'):
+        del state[name]
+    state['data'] = data
+    state['sw_data'] = [x[x.index > START_DATE] for x in data]
+    old = Environment.__new__(Environment)
+    old.__setstate__(state)
+    assert 'data' not in vars(old) and 'sw_data' not in vars(old)
+    assert old.observations[0].values.dtype == np.float64
+    for series, observations in zip(data, old.observations):
+        assert np.array_equal(observations.get_values(), series.values)
+    assert [len(x) for x in old.arm_states] == [10, 10]
+    assert pickle.loads(pickle.dumps(old, -1)).data[1].equals(old.data[1])
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
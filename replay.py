@@ -0,0 +1,156 @@
+"""Offline evaluation of bandit policies by replaying logged assignments and rewards"""
+
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+from analytics.bandit.arm_stats import ArmState, summarize, moments
+from analytics.bandit.environment import Environment
+
+DEFAULT_CHUNK_SIZE = 1000000
+Z_SCORE = 1.96  # two sided 95% confidence intervals
+
+
+def read_chunks(logs, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Returns an iterable of dataframes from a dataframe, a path to a csv or an iterable of
+    dataframes, so logs larger than memory can be streamed"""
+    if isinstance(logs, pd.DataFrame):
+        return [logs]
+    if isinstance(logs, basestring):
+        return pd.read_csv(logs, chunksize=chunk_size)
+    return logs
+
+
+def split_days(chunks, date_column='date'):
+    """Yields (day, rows) for every day in chunks of logs sorted by date. A day split across two
+    chunks is held back until the next chunk so it is replayed as one day."""
+    held = None
+    for chunk in chunks:
+        chunk = chunk.assign(**{date_column: pd.to_datetime(chunk[date_column]).dt.date})
+        if held is not None:
+            chunk = pd.concat([held, chunk], ignore_index=True)
+        groups = list(chunk.groupby(date_column, sort=True))
+        if not groups:
+            continue
+        for day, rows in groups[:-1]:
+            yield day, rows
+        held = groups[-1][1]
+    if held is not None:
+        yield held[date_column].iloc[0], held
+
+
+class Replay(object):
+    """Replays logged (date, arm, reward) history against a bandit policy. The policy learns from
+    rows accepted by rejection sampling and its value is estimated by inverse propensity weighting.
+    propensity_column - Column with the probability the logged arm was assigned. Defaults to the
+    share of the day's rows on each arm."""
+
+    def __init__(self, bandit, arm, arm_names, batch=None, sliding_window=None, half_life=None,
+                 min_size=None, arm_column='shard', date_column='date', value_column='value',
+                 propensity_column=None):
+        self.bandit = bandit
+        self.arm = arm
+        self.arm_names = list(arm_names)
+        self.k = len(self.arm_names)
+        self.arm_index = {name: i for i, name in enumerate(self.arm_names)}
+        self.batch = batch
+        self.sliding_window = sliding_window
+        self.half_life = half_life
+        self.min_size = min_size
+        self.arm_column = arm_column
+        self.date_column = date_column
+        self.value_column = value_column
+        self.propensity_column = propensity_column
+        self.env = None
+        self.logged = [ArmState() for _ in xrange(self.k)]
+        self.weighted = np.zeros(3)  # events, sum and sum of squares of the weighted rewards
+        self.days = []
+
+    def __str__(self):
+        return 'Replay of logged data against the {}'.format(self.bandit)
+
+    def new_environment(self, start_date):
+        """Returns an environment to run the policy from the first logged day"""
+        return Environment(self.k, self.bandit, self.arm, arm_names=self.arm_names,
+                           start_date=start_date, batch=self.batch,
+                           sliding_window=self.sliding_window, half_life=self.half_life,
+                           keep_data=False)
+
+    def get_codes(self, rows):
+        """Returns the arm index of every row"""
+        codes = rows[self.arm_column].map(self.arm_index)
+        if codes.isnull().any():
+            raise RuntimeError('Logged arms {} are not in the arm names'.format(
+                sorted(set(rows[self.arm_column][codes.isnull()]))))
+        return codes.values.astype(int)
+
+    def replay_day(self, day, rows):
+        """Replays one day of logged rows and updates the policy with the accepted rows"""
+        if self.env is None:
+            self.env = self.new_environment(day)
+        codes = self.get_codes(rows)
+        values = rows[self.value_column].values.astype(float)
+        n = len(codes)
+
+        policy = np.bincount(self.env.allocation, minlength=self.k) / float(self.env.batch)
+        logging = np.bincount(codes, minlength=self.k) / float(n)
+        if self.propensity_column is not None:
+            row_logging = rows[self.propensity_column].values.astype(float)
+        else:
+            row_logging = logging[codes]
+        weights = policy[codes] / row_logging
+        weighted = weights * values
+
+        # rows are accepted in proportion to their weight, so the bound is the largest weight
+        bound = weights.max()
+        accept = np.random.random(n) < weights / bound if bound > 0 else np.zeros(n, dtype=bool)
+
+        new_data = [pd.Series(values[accept & (codes == i)]) for i in xrange(self.k)]
+        for series in new_data:
+            series.index = [day] * len(series)
+        self.env.run_cycle(new_data=new_data, run_date=day + timedelta(days=1),
+                           min_size=self.min_size)
+
+        for i in xrange(self.k):
+            self.logged[i].add(day, summarize(pd.Series(values[codes == i])))
+        self.weighted += [n, weighted.sum(), (weighted ** 2).sum()]
+        self.days.append(dict(date=day, events=n, accepted=int(accept.sum()),
+                              value=weighted.mean(), logged_mean=values.mean(),
+                              unsupported=policy[logging == 0].sum()))
+
+    def run(self, logs, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Replays logs sorted by date, given as a dataframe, a csv path or an iterable of
+        dataframes, and returns the summary"""
+        for day, rows in split_days(read_chunks(logs, chunk_size), self.date_column):
+            self.replay_day(day, rows)
+        return self.get_summary()
+
+    def get_report(self):
+        """Returns a dataframe of each replayed day"""
+        return pd.DataFrame(self.days, columns=['date', 'events', 'accepted', 'value',
+                                                'logged_mean', 'unsupported'])
+
+    def get_summary(self):
+        """Returns the estimated value per event, reward and regret of the policy over the logged
+        events with their confidence intervals"""
+        n, total, total_sq = self.weighted
+        if n == 0:
+            raise RuntimeError('No logged data has been replayed')
+        value = total / n
+        value_se = np.sqrt(max(total_sq / n - value ** 2, 0) / n)
+
+        arm_moments = [moments(state.stats) for state in self.logged]
+        means = np.array([m[1] if m[0] > 0 else -np.inf for m in arm_moments])
+        best = np.argmax(means)
+        best_n, best_mean, best_ssd = arm_moments[best]
+        regret_se = np.sqrt(value_se ** 2 + best_ssd / best_n ** 2)
+        logged_mean = sum(m[0] * m[1] for m in arm_moments if m[0] > 0) / n
+
+        return pd.Series(dict(
+            events=int(n), accepted=sum(day['accepted'] for day in self.days),
+            value=value, value_lower=value - Z_SCORE * value_se,
+            value_upper=value + Z_SCORE * value_se, reward=value * n,
+            reward_lower=(value - Z_SCORE * value_se) * n,
+            reward_upper=(value + Z_SCORE * value_se) * n, logged_mean=logged_mean,
+            best_arm=self.arm_names[best], best_mean=best_mean, regret=(best_mean - value) * n,
+            regret_lower=(best_mean - value - Z_SCORE * regret_se) * n,
+            regret_upper=(best_mean - value + Z_SCORE * regret_se) * n))
@@ -0,0 +1,70 @@
+"""
+Tests offline replay of logged assignments
+"""
+from analytics.bandit.arm import BinomialArm
+from analytics.bandit.bandit import BayesianBandit
+from analytics.bandit.replay import Replay, split_days
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+
+START_DATE = date(2017, 4, 1)
+PS = np.array([.1, .3])
+
+
+def new_logs(days=1, n=100000, logging=(.8, .2), seed=0):
+    """Returns logs of n rows a day assigned with the logging shares"""
+    random = np.random.RandomState(seed)
+    shards = random.choice(2, size=days * n, p=logging)
+    return pd.DataFrame(dict(date=np.repeat([START_DATE + timedelta(days=d)
+                                             for d in xrange(days)], n),
+                             shard=np.array(['a', 'b'])[shards],
+                             value=(random.random_sample(days * n) < PS[shards]).astype(int)))
+
+
+def test_inverse_propensity_value():
+    replay = Replay(BayesianBandit(), BinomialArm(), ['a', 'b'], batch=1000)
+    summary = replay.run(new_logs())
+    # the first day is replayed with an equal allocation
+    assert summary.value_lower < PS.mean() < summary.value_upper
+    assert abs(summary.logged_mean - .14) < .01
+    assert summary.best_arm == 'b'
+
+
+def test_rejection_sampling():
+    replay = Replay(BayesianBandit(), BinomialArm(), ['a', 'b'], batch=1000)
+    replay.run(new_logs())
+    # shares of .5 over logging shares of .8 and .2 accept a quarter of a's rows and all of b's
+    accepted = replay.get_report().accepted.iloc[0]
+    assert abs(accepted - 40000) < 1000
+    counts = [state.stats[0] for state in replay.env.arm_states]
+    assert abs(counts[0] - counts[1]) < 1000
+
+
+def test_rejection_sampling_with_propensities():
+    logs = new_logs()
+    random = np.random.RandomState(1)
+    # each row's logged propensity differs from its arm's share of the day
+    logs['propensity'] = np.where(logs.shard == 'a', random.choice([.7, .9], len(logs)),
+                                  random.choice([.1, .3], len(logs)))
+    replay = Replay(BayesianBandit(), BinomialArm(), ['a', 'b'], batch=1000,
+                    propensity_column='propensity')
+    replay.run(logs)
+    weights = .5 / logs.propensity
+    accepted = replay.get_report().accepted.iloc[0]
+    assert abs(accepted - (weights / weights.max()).sum()) < 1000
+
+
+def test_split_days():
+    logs = new_logs(days=3, n=10)
+    chunks = [logs.iloc[:15], logs.iloc[15:22], logs.iloc[22:]]
+    days = [(day, len(rows)) for day, rows in split_days(chunks)]
+    assert days == [(START_DATE + timedelta(days=d), 10) for d in xrange(3)]
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
@@ -0,0 +1,58 @@
+"""
+Tests synthetic scenarios shared across environments
+"""
+from analytics.bandit.arm import BinomialArm
+from analytics.bandit.bandit import BayesianBandit
+from analytics.bandit.environment import Environment, Scenario
+from datetime import date
+import numpy as np
+
+
+def new_environment(scenario, k=3):
+    return Environment(k, BayesianBandit(), BinomialArm(), start_date=date(2017, 4, 1), batch=300,
+                       test_vars=dict(scenario=scenario))
+
+
+def test_drift():
+    scenario = Scenario('binomial', ps=[.1, .2], drift=[.01, 0.])
+    assert np.allclose(scenario.get_means(10), [.2, .2])
+    counts = np.array([200000, 200000])
+    rewards = scenario.draw(counts, cycle=10)
+    assert abs(rewards[:200000].mean() - .2) < .005
+
+
+def test_shared_scenario():
+    scenario = Scenario('binomial', ps=[.1, .2, .3], drift=[.01, 0., 0.], delay=2)
+    env_a, env_b = new_environment(scenario), new_environment(scenario)
+    for cycle in xrange(4):
+        for env in (env_a, env_b):
+            assert env.get_cycle() == cycle
+            env.run_cycle(incremental=True)
+    for env in (env_a, env_b):
+        assert [s.get_max_date() for s in env.arm_states] == [date(2017, 4, 2)] * 3
+        assert sum(s.stats[0] for s in env.arm_states) == 2 * env.batch
+
+
+def test_delay_after_add_arm():
+    env = new_environment(Scenario('binomial', ps=[.1, .2, .3, .4], delay=1))
+    env.run_cycle(incremental=True)
+    env.add_arm()
+    env.run_cycle(incremental=True)
+    assert len(env.arm_states) == 4
+
+
+def test_common_random_numbers():
+    scenario = Scenario('zero_inflated_lognormal', mus=[0., .5], sigmas=[1., 1.], ps=[.3, .3])
+    uniforms, normals = np.random.random((2, 100)), np.random.normal(size=(2, 100))
+    counts = np.array([40, 60])
+    first = scenario.draw(counts, 0, uniforms, normals)
+    assert np.array_equal(first, scenario.draw(counts, 0, uniforms, normals))
+    assert np.array_equal(first[:40] > 0, uniforms[0, :40] < .3)
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
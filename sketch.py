@@ -0,0 +1,93 @@
+"""Mergeable quantile sketches for summarizing large streams of values in bounded memory"""
+
+import numpy as np
+
+DEFAULT_SKETCH_SIZE = 1000
+CAPACITY_DECAY = 2. / 3
+MIN_CAPACITY = 2
+
+
+class QuantileSketch(object):
+    """A mergeable KLL style quantile sketch, where a value at level h stands in for 2 ** h values
+    size - Capacity of the top level. Larger sizes give more accurate quantiles."""
+
+    def __init__(self, size=DEFAULT_SKETCH_SIZE):
+        self.size = size
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def __len__(self):
+        return self.n
+
+    def copy(self):
+        """Returns an independent copy of the sketch"""
+        sketch = QuantileSketch(self.size)
+        sketch.levels = [level.copy() for level in self.levels]
+        sketch.n, sketch.min, sketch.max = self.n, self.min, self.max
+        return sketch
+
+    def capacity(self, level):
+        """Returns the number of values a level can hold before it is compacted"""
+        depth = len(self.levels) - 1 - level
+        return max(MIN_CAPACITY, int(self.size * CAPACITY_DECAY ** depth))
+
+    def update(self, values):
+        """Adds an array of values to the sketch"""
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size == 0:
+            return self
+        self.n += values.size
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compress()
+        return self
+
+    def merge(self, other):
+        """Merges another sketch into this one"""
+        if other.n == 0:
+            return self
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, level in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+        return self
+
+    def compress(self):
+        """Compacts levels until every level is within its capacity"""
+        compacted = True
+        while compacted:
+            compacted = False
+            for h in xrange(len(self.levels)):
+                if len(self.levels[h]) <= self.capacity(h):
+                    continue
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                level = np.sort(self.levels[h])
+                # an odd value out stays behind so the total weight is preserved
+                keep = len(level) % 2
+                promoted = level[keep:][np.random.randint(2)::2]
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+                self.levels[h] = level[:keep]
+                compacted = True
+
+    def quantile(self, q):
+        """Returns the estimated values at quantiles q"""
+        q = np.asarray(q, dtype=float)
+        if self.n == 0:
+            return np.full(q.shape, np.nan)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.repeat(2. ** h, len(level))
+                                  for h, level in enumerate(self.levels)])
+        order = np.argsort(values)
+        values = values[order]
+        cum_weights = np.cumsum(weights[order])
+        ranks = q * cum_weights[-1]
+        index = np.minimum(np.searchsorted(cum_weights, ranks), len(values) - 1)
+        return np.clip(values[index], self.min, self.max)
@@ -0,0 +1,98 @@
+"""
+Tests quantile sketches and the quantiles of environment performance reports
+"""
+from analytics.bandit.arm import NormalArm
+from analytics.bandit.arm_stats import reduce_partitions
+from analytics.bandit.bandit import RandomBandit
+from analytics.bandit.change_point import PageHinkley
+from analytics.bandit.environment import Environment
+from analytics.bandit.sketch import QuantileSketch
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+
+QUANTILES = (.1, .5, .9)
+START_DATE = date(2017, 4, 1)
+
+
+def rank_error(values, estimates, quantiles=QUANTILES):
+    """Largest difference between the quantiles and the ranks of their estimates"""
+    values = np.sort(values)
+    ranks = np.searchsorted(values, estimates) / float(len(values))
+    return np.abs(ranks - np.asarray(quantiles)).max()
+
+
+def test_quantiles():
+    values = np.random.lognormal(size=100000)
+    sketch = QuantileSketch(200)
+    for chunk in np.array_split(values, 37):
+        sketch.update(chunk)
+    assert len(sketch) == len(values)
+    assert sum(len(level) for level in sketch.levels) < 1000
+    assert rank_error(values, sketch.quantile(QUANTILES)) < .02
+
+
+def test_merge():
+    values = np.random.normal(size=(4, 20000))
+    sketches = [QuantileSketch(200) for _ in values]
+    for sketch, part in zip(sketches, values):
+        sketch.update(part)
+    merged = sketches[0].copy()
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    assert len(merged) == values.size and len(sketches[0]) == values.shape[1]
+    assert rank_error(values.ravel(), merged.quantile(QUANTILES)) < .02
+
+
+def new_data(day, mean, n=500):
+    return [pd.Series(np.random.normal(mean, 1., n), index=[day] * n)]
+
+
+def test_change_point_quantiles():
+    np.random.seed(0)
+    env = Environment(1, RandomBandit(), NormalArm(), start_date=START_DATE, batch=500,
+                      sketch_size=200, change_detector=PageHinkley())
+    for cycle in xrange(30):
+        day = START_DATE + timedelta(days=cycle)
+        env.run_cycle(run_date=day + timedelta(days=1),
+                      new_data=new_data(day, 5. if cycle >= 15 else 0.))
+    assert len(env.change_points) == 1
+    lifetime = env.get_performance(quantiles=QUANTILES)
+    current = env.get_performance(sliding_window=True, quantiles=QUANTILES)
+    assert abs(lifetime['q0.5'].iloc[0] - 2.5) < 2.
+    assert abs(current['q0.5'].iloc[0] - 5.) < .2
+
+
+def test_partitioned_quantiles():
+    np.random.seed(0)
+    days = [START_DATE + timedelta(days=d) for d in xrange(10)]
+    logs = pd.DataFrame(dict(shard=np.tile(['a', 'b'], 2500), date=np.repeat(days, 500),
+                             value=np.random.normal(size=5000)))
+    logs.loc[logs.shard == 'b', 'value'] += 3.
+    states, sketches = reduce_partitions([logs.iloc[:2250], logs.iloc[2250:]], NormalArm(),
+                                         processes=1, sketch_size=200)
+    assert sorted(sketches) == ['a', 'b'] and sorted(sketches['a']) == days
+    env = Environment(2, RandomBandit(), NormalArm(), arm_names=['a', 'b'],
+                      start_date=START_DATE, run_date=days[-1] + timedelta(days=1),
+                      sliding_window=3, sketch_size=200)
+    env.merge_arm_states(states, day_sketches=sketches)
+    assert sorted(env.day_sketches[0]) == days[-3:] and len(env.sketches[0]) == 1750
+    for i, name in enumerate(env.arm_names):
+        values = logs.value[logs.shard == name]
+        assert rank_error(values, env.get_quantiles(i, QUANTILES)) < .02
+        recent = values[logs.date >= days[-3]]
+        assert rank_error(recent, env.get_quantiles(i, QUANTILES, sliding_window=True)) < .02
+    try:
+        env.merge_arm_states(states)
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('merged states without their sketches')
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
@@ -0,0 +1,89 @@
+"""Publishes allocations as fixed layout binary snapshots that many processes can memory map"""
+
+import os
+import mmap
+import struct
+import time
+import numpy as np
+
+MAGIC = 'BNDT'
+FORMAT_VERSION = 1
+# magic, format version, snapshot version, created time, k, name width, number of stats
+HEADER = struct.Struct('<4sHxxQdIII4x')
+SNAPSHOT_STATS = ('len', 'mean', 'std', 'sem')
+
+
+def padded(size, alignment=8):
+    """Rounds size up to a multiple of alignment"""
+    return -(-size // alignment) * alignment
+
+
+def write_snapshot(path, names, weights, stats, version):
+    """Atomically writes a snapshot of the allocation weights and summary stats of each arm to
+    path: a header, the null padded arm names, then k weights and k by len(SNAPSHOT_STATS) stats
+    as float64"""
+    names = [name.encode('utf-8') if isinstance(name, unicode) else str(name) for name in names]
+    k = len(names)
+    name_width = padded(max([len(name) for name in names] + [1]))
+    weights = np.asarray(weights, dtype='<f8').reshape(k)
+    stats = np.asarray(stats, dtype='<f8').reshape(k, len(SNAPSHOT_STATS))
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, version, time.time(), k, name_width,
+                         len(SNAPSHOT_STATS))
+    name_bytes = ''.join(name.ljust(name_width, '\0') for name in names)
+
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as output:
+        output.write(header)
+        output.write(name_bytes)
+        output.write(weights.tostring())
+        output.write(stats.tostring())
+        output.flush()
+        os.fsync(output.fileno())
+    os.rename(temp_path, path)
+
+
+class Snapshot(object):
+    """A snapshot mapped into memory. weights and stats are read only views of the mapping."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self.mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, format_version, self.version, self.created, self.k, name_width, n_stats = \
+            HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise RuntimeError('{} is not a version {} allocation snapshot'.format(
+                path, FORMAT_VERSION))
+
+        offset = HEADER.size
+        self.names = [self.mmap[offset + i * name_width:offset + (i + 1) * name_width].rstrip('\0')
+                      for i in xrange(self.k)]
+        offset += self.k * name_width
+        self.weights = np.frombuffer(self.mmap, dtype='<f8', count=self.k, offset=offset)
+        offset += self.k * 8
+        self.stats = np.frombuffer(self.mmap, dtype='<f8', count=self.k * n_stats,
+                                   offset=offset).reshape(self.k, n_stats)
+
+    def get_weights(self):
+        """Returns a dictionary of arm name to allocation weight"""
+        return dict(zip(self.names, self.weights))
+
+
+class SnapshotReader(object):
+    """Follows the snapshots published at path. read() only remaps the file when a new snapshot has
+    replaced it, so checking for a new version is one stat call and needs no locks."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file_id = None
+        self.snapshot = None
+
+    def read(self):
+        """Returns the latest snapshot"""
+        info = os.stat(self.path)
+        file_id = (info.st_ino, info.st_mtime, info.st_size)
+        if file_id != self.file_id:
+            self.snapshot = Snapshot(self.path)
+            self.file_id = file_id
+        return self.snapshot
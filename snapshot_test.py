@@ -0,0 +1,110 @@
+"""
+Tests writing and reading memory mapped allocation snapshots
+"""
+from analytics.bandit.arm import NormalArm
+from analytics.bandit.bandit import BayesianBandit
+from analytics.bandit.environment import Environment
+from analytics.bandit.snapshot import Snapshot, SnapshotReader, write_snapshot, SNAPSHOT_STATS
+from datetime import date, timedelta
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import tempfile
+
+NAMES = ['control', u'variant_\xe9', 'c']
+
+
+def new_snapshot(path, version, scale=1.):
+    weights = np.array([.2, .3, .5]) * scale
+    stats = np.arange(len(NAMES) * len(SNAPSHOT_STATS), dtype=float).reshape(len(NAMES), -1)
+    write_snapshot(path, NAMES, weights, stats * scale, version)
+    return weights, stats * scale
+
+
+def test_round_trip():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'snapshot')
+        weights, stats = new_snapshot(path, 7)
+        snapshot = Snapshot(path)
+        assert snapshot.version == 7 and snapshot.k == 3
+        assert snapshot.names == ['control', u'variant_\xe9'.encode('utf-8'), 'c']
+        assert np.array_equal(snapshot.weights, weights)
+        assert np.array_equal(snapshot.stats, stats)
+        assert snapshot.get_weights()['c'] == .5
+        assert os.listdir(directory) == ['snapshot']
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_not_a_snapshot():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'snapshot')
+        with open(path, 'wb') as output:
+            output.write('\0' * 64)
+        try:
+            Snapshot(path)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('read a file that is not a snapshot')
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_reader_sees_complete_snapshots():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'snapshot')
+        weights, stats = new_snapshot(path, 1)
+        reader = SnapshotReader(path)
+        first = reader.read()
+        assert reader.read() is first
+
+        # a writer that has not renamed its file yet leaves the published snapshot untouched
+        with open('{}.{}.tmp'.format(path, os.getpid() + 1), 'wb') as output:
+            output.write('BNDT')
+        assert reader.read() is first and Snapshot(path).version == 1
+
+        new_weights, new_stats = new_snapshot(path, 2, scale=2.)
+        second = reader.read()
+        assert second is not first and second.version == 2
+        assert np.array_equal(second.weights, new_weights)
+        assert np.array_equal(second.stats, new_stats)
+        # the old mapping still holds the whole snapshot it was opened on
+        assert first.version == 1 and np.array_equal(first.weights, weights)
+        assert np.array_equal(first.stats, stats)
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_environment_versions():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'snapshot')
+        run_date = date(2017, 4, 10)
+        env = Environment(2, BayesianBandit(), NormalArm(), start_date=date(2017, 4, 1),
+                          run_date=run_date, batch=100, snapshot_path=path)
+        for cycle in xrange(2):
+            day = run_date + timedelta(days=cycle)
+            env.run_cycle(run_date=day + timedelta(days=1),
+                          new_data=[pd.Series(np.random.normal(mu, 1., 50), index=[day] * 50)
+                                    for mu in (0., 1.)])
+        snapshot = Snapshot(path)
+    finally:
+        shutil.rmtree(directory)
+    assert snapshot.version == env.snapshot_version == 2
+    assert snapshot.names == env.get_arm_names()
+    assert abs(snapshot.weights.sum() - 1.) < 1e-9
+    assert (snapshot.stats[:, 0] == 100).all()
+    assert abs(snapshot.stats[1, 1] - 1.) < .5
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
@@ -0,0 +1,35 @@
+"""
+Measures the cold start of the core bandit api in fresh interpreters
+"""
+import subprocess
+import sys
+
+STEPS = """
+import sys, time
+start = time.time()
+import numpy as np
+from datetime import date
+from analytics.bandit.arm import BinomialArm
+from analytics.bandit.arm_stats import ArmState, summarize
+from analytics.bandit.bandit import BayesianBandit
+import_time = time.time() - start
+loaded = [name for name in ('pandas', 'scipy') if name in sys.modules]
+states = [ArmState() for _ in xrange(5)]
+for state, p in zip(states, [.1, .11, .12, .08, .085]):
+    state.add(date(2017, 4, 1), summarize(np.random.binomial(1, p, 1000)))
+start = time.time()
+BayesianBandit().select_arm(5, BinomialArm(), states, None, date(2017, 4, 1), date(2017, 4, 2),
+                            None, 1000)
+decision_time = time.time() - start
+print '{:.3f} {:.3f} {}'.format(import_time, decision_time, ','.join(loaded) or 'none')
+"""
+
+
+if __name__ == '__main__':
+
+    RUNS = 5
+
+    for i in xrange(RUNS):
+        output = subprocess.check_output([sys.executable, '-c', STEPS]).split()
+        print 'import: {}s, first allocation: {}s, pandas/scipy loaded by import: {}'.format(
+            *output)
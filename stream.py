@@ -0,0 +1,189 @@
+"""Continuously ingests reward events into a bandit environment and recomputes allocations"""
+
+import os
+import socket
+import select
+import time
+import logging
+import pandas as pd
+from Queue import Queue, Empty
+from datetime import datetime, date, timedelta
+
+DEFAULT_INTERVAL = 60.
+DEFAULT_MAX_EVENTS = 10000
+DEFAULT_POLL_TIMEOUT = 1.
+
+
+def parse_event(line):
+    """Parses a line of the form arm_name,YYYY-MM-DD,value into an event"""
+    name, day, value = line.strip().split(',')
+    return name, datetime.strptime(day, '%Y-%m-%d').date(), float(value)
+
+
+class EventSource(object):
+    """A source of (arm name, date, value) reward events"""
+
+    def poll(self, timeout, max_events):
+        """Abstract method to return a list of up to max_events events, waiting up to timeout
+        seconds for the first one"""
+        raise NotImplementedError
+
+    def close(self):
+        """Releases any resources held by the source"""
+        pass
+
+
+class QueueSource(EventSource):
+    """Events put on an in-process queue, for example by a thread handling requests"""
+
+    def __init__(self, queue=None):
+        self.queue = queue if queue is not None else Queue()
+
+    def put(self, name, value, day=None):
+        """Adds an event for arm name collected on day, defaulting to today"""
+        self.queue.put((name, day if day is not None else date.today(), float(value)))
+
+    def poll(self, timeout, max_events):
+        events = []
+        try:
+            events.append(self.queue.get(timeout=timeout))
+            while len(events) < max_events:
+                events.append(self.queue.get_nowait())
+        except Empty:
+            pass
+        return events
+
+
+class FileSource(EventSource):
+    """Events appended as lines to a file, which is followed like tail -f
+    from_start - Reads the events already in the file instead of starting at its end."""
+
+    def __init__(self, path, from_start=False):
+        self.path = path
+        self.file = open(path, 'r')
+        if not from_start:
+            self.file.seek(0, os.SEEK_END)
+        self.partial = ''
+
+    def poll(self, timeout, max_events):
+        events = []
+        deadline = time.time() + timeout
+        while not events:
+            lines = (self.partial + self.file.read()).split('\n')
+            # the last piece is an incomplete line until its newline is written
+            self.partial = lines.pop()
+            events = [parse_event(line) for line in lines if line.strip()]
+            if events or time.time() >= deadline:
+                break
+            time.sleep(min(.1, timeout))
+        return events
+
+    def close(self):
+        self.file.close()
+
+
+class UnixSocketSource(EventSource):
+    """Events sent as datagrams of newline separated lines to a Unix socket at path"""
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            os.remove(path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(path)
+        self.socket.setblocking(0)
+
+    def poll(self, timeout, max_events):
+        events = []
+        readable, __, __ = select.select([self.socket], [], [], timeout)
+        while readable and len(events) < max_events:
+            try:
+                datagram = self.socket.recv(65536)
+            except socket.error:
+                break
+            events.extend(parse_event(line) for line in datagram.split('\n') if line.strip())
+        return events
+
+    def close(self):
+        self.socket.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StreamIngestor(object):
+    """Micro-batches events from a source into an environment and recomputes the allocation every
+    interval seconds or max_events events, adding arms it has not seen.
+    on_allocation - Optional function called with the environment after every new allocation.
+    arm_features - Function returning the feature row of a new arm from its name, needed when the
+        environment's arm is a LinearArm."""
+
+    def __init__(self, env, source, interval=DEFAULT_INTERVAL, max_events=DEFAULT_MAX_EVENTS,
+                 poll_timeout=DEFAULT_POLL_TIMEOUT, on_allocation=None, min_size=None,
+                 arm_features=None):
+        self.env = env
+        self.source = source
+        self.interval = interval
+        self.max_events = max_events
+        self.poll_timeout = poll_timeout
+        self.on_allocation = on_allocation
+        self.min_size = min_size
+        self.arm_features = arm_features
+        self.buffer = []
+        self.last_allocation = time.time()
+        self.running = False
+
+    def stop(self):
+        """Stops the ingestion loop after the current poll"""
+        self.running = False
+
+    def run(self, duration=None):
+        """Ingests events until stopped or for duration seconds, then flushes remaining events"""
+        self.running = True
+        end_time = time.time() + duration if duration is not None else None
+        try:
+            while self.running and (end_time is None or time.time() < end_time):
+                timeout = min(self.poll_timeout,
+                              max(self.last_allocation + self.interval - time.time(), 0))
+                self.buffer.extend(self.source.poll(timeout, self.max_events - len(self.buffer)))
+                if (len(self.buffer) >= self.max_events or
+                        time.time() - self.last_allocation >= self.interval):
+                    self.flush()
+        finally:
+            self.flush()
+            self.running = False
+
+    def flush(self):
+        """Adds the buffered events to the environment and recomputes its allocation"""
+        self.last_allocation = time.time()
+        if not self.buffer:
+            return
+        events, self.buffer = self.buffer, []
+        env = self.env
+
+        for name in set(event[0] for event in events):
+            if name not in env.get_arm_names():
+                env.add_arm(name=name, features=self.arm_features(name)
+                            if self.arm_features is not None else None)
+
+        arm_index = {name: i for i, name in enumerate(env.get_arm_names())}
+        values = [[] for _ in xrange(env.k)]
+        dates = [[] for _ in xrange(env.k)]
+        for name, day, value in events:
+            values[arm_index[name]].append(value)
+            dates[arm_index[name]].append(day)
+        new_data = [pd.Series(values[i], index=dates[i]) for i in xrange(env.k)]
+
+        last_day = max(event[1] for event in events)
+        if last_day >= env.run_date:
+            env.decay((last_day - env.run_date).days + 1)
+            env.update_run_date(run_date=last_day + timedelta(days=1))
+
+        env.add_data(new_data)
+        if not env.data_empty():
+            env.allocation = env.calculate_allocation(min_size=self.min_size)
+            if env.snapshot_path is not None:
+                env.publish_snapshot()
+        logging.info('Ingested {} events into {}'.format(len(events), env.get_label()))
+
+        if self.on_allocation is not None:
+            self.on_allocation(env)
@@ -0,0 +1,166 @@
+"""Parallel parameter sweeps of bandit policies and priors over simulated scenarios"""
+
+import os
+import hashlib
+import itertools
+import cPickle as pickle
+import numpy as np
+import pandas as pd
+from datetime import date
+from multiprocessing import Pool
+from analytics.bandit.arm import ALL_BANDIT_ARMS
+from analytics.bandit.bandit import ALL_BANDIT_MODELS
+from analytics.bandit.environment import Environment, Scenario
+from analytics.bandit.experiment import get_true_means
+
+DEFAULT_CYCLES = 60
+DEFAULT_REPLICATIONS = 20
+SCENARIO_START_DATE = date(2017, 1, 1)
+
+
+def expand_grid(grid):
+    """Returns every combination of a parameter grid as a list of dicts. The grid maps names to
+    lists of values: 'bandit' and 'arm' name models in ALL_BANDIT_MODELS and ALL_BANDIT_ARMS, and
+    'bandit.<param>', 'arm.<param>' and 'env.<param>' are passed to their constructors, e.g.
+    dict(bandit=['epsilon'], **{'bandit.epsilon': [.05, .1], 'env.sliding_window': [None, 14]})"""
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[x] for x in names])]
+
+
+def get_params(params, prefix):
+    """Returns the constructor parameters with the given prefix"""
+    return {name.split('.', 1)[1]: value for name, value in params.iteritems()
+            if name.startswith(prefix + '.')}
+
+
+def get_key(*values):
+    """Returns a stable hash of the given values to name cached cells. Dicts and scenarios are
+    keyed by their sorted items."""
+    return hashlib.md5(repr([sorted(vars(x).items()) if isinstance(x, Scenario) else
+                             sorted(x.items()) if isinstance(x, dict) else x
+                             for x in values])).hexdigest()
+
+
+def run_cell(params, scenario, cycles=DEFAULT_CYCLES, batch=None, seed=None):
+    """Runs one replication of one grid cell over a Scenario and returns its cumulative expected
+    regret per cycle, computed from the allocation counts and the true means"""
+    np.random.seed(seed)
+    bandit = ALL_BANDIT_MODELS[params.get('bandit', 'bayesian')](**get_params(params, 'bandit'))
+    arm = ALL_BANDIT_ARMS[params.get('arm', scenario.reward)](**get_params(params, 'arm'))
+    k = len(scenario.get_means())
+    env = Environment(k, bandit, arm, start_date=SCENARIO_START_DATE, batch=batch,
+                      test_vars=dict(scenario=scenario), **get_params(params, 'env'))
+
+    pulls = reward = optimal = 0.
+    results = []
+    for cycle in xrange(cycles):
+        means = get_true_means(env)
+        counts = np.bincount(env.allocation, minlength=k)
+        pulls += counts.sum()
+        reward += np.dot(counts, means)
+        optimal += counts.sum() * means.max()
+        env.run_cycle(incremental=True)
+        results.append((cycle, pulls, reward, optimal - reward))
+    return pd.DataFrame(results, columns=['cycle', 'pulls', 'reward', 'regret'])
+
+
+def write_columns(results, path):
+    """Writes a dataframe to an npz file with one array per column, so columns can be loaded
+    without reading the others. numpy adds .npz to paths without it."""
+    arrays = [values.astype(str) if values.dtype == object else values
+              for values in (results[column].values for column in results.columns)]
+    np.savez(path, np.array(results.columns, dtype=str), *arrays)
+
+
+def read_columns(path, columns=None):
+    """Returns a dataframe of the given columns, or all of them, of a file from write_columns"""
+    arrays = np.load(path)
+    try:
+        names = list(arrays['arr_0'])
+        columns = names if columns is None else columns
+        return pd.DataFrame({name: arrays['arr_{}'.format(names.index(name) + 1)]
+                             for name in columns}, columns=columns)
+    finally:
+        arrays.close()
+
+
+def _run_cell_job(args):
+    """Runs a cell in a worker and caches its result, returning the path"""
+    params, scenario, cycles, batch, replication, path = args
+    seed = int(get_key(params, scenario, cycles, batch, replication)[:8], 16)
+    results = run_cell(params, scenario, cycles, batch, seed)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as output:
+        pickle.dump(results, output, -1)
+    os.rename(temp_path, path)
+    return path
+
+
+class Sweep(object):
+    """Runs a parameter grid over a Scenario with replications in parallel. Each finished cell is
+    cached in cache_directory, so an interrupted sweep resumes where it stopped."""
+
+    def __init__(self, grid, scenario, cache_directory, cycles=DEFAULT_CYCLES, batch=None,
+                 replications=DEFAULT_REPLICATIONS, processes=None):
+        self.configs = expand_grid(grid)
+        self.scenario = scenario
+        self.cycles = cycles
+        self.batch = batch
+        self.cache_directory = cache_directory
+        self.replications = replications
+        self.processes = processes
+
+    def __str__(self):
+        return 'Sweep of {} configurations with {} replications'.format(len(self.configs),
+                                                                        self.replications)
+
+    def get_cell_path(self, params, replication):
+        """Returns the cache path of a cell"""
+        return os.path.join(self.cache_directory, '{}.pkl'.format(
+            get_key(params, self.scenario, self.cycles, self.batch, replication)))
+
+    def run(self, path=None):
+        """Runs the cells missing from the cache and returns the aggregated results, writing them
+        to path if given with write_columns"""
+        if not os.path.isdir(self.cache_directory):
+            os.makedirs(self.cache_directory)
+        jobs = [(params, self.scenario, self.cycles, self.batch, replication,
+                 self.get_cell_path(params, replication))
+                for params in self.configs for replication in xrange(self.replications)]
+        jobs = [job for job in jobs if not os.path.exists(job[-1])]
+        if jobs:
+            pool = Pool(self.processes)
+            try:
+                for _ in pool.imap_unordered(_run_cell_job, jobs):
+                    pass
+            finally:
+                pool.close()
+                pool.join()
+
+        results = self.get_results()
+        if path is not None:
+            write_columns(results, path)
+        return results
+
+    def get_results(self):
+        """Returns the mean, standard deviation and standard error of the regret for each
+        configuration and cycle, with a column per parameter"""
+        results = []
+        for config, params in enumerate(self.configs):
+            for replication in xrange(self.replications):
+                with open(self.get_cell_path(params, replication), 'rb') as pickle_input:
+                    cell = pickle.load(pickle_input)
+                results.append(cell.assign(config=config))
+        results = pd.concat(results, ignore_index=True)
+
+        grouped = results.groupby(['config', 'cycle'])
+        aggregated = grouped[['pulls', 'reward']].mean()
+        aggregated['regret'] = grouped['regret'].mean()
+        aggregated['regret_std'] = grouped['regret'].std()
+        aggregated['regret_sem'] = grouped['regret'].sem()
+        aggregated['replications'] = grouped['regret'].size()
+        aggregated = aggregated.reset_index()
+
+        params = pd.DataFrame(self.configs)
+        params['config'] = np.arange(len(self.configs))
+        return params.merge(aggregated, on='config')
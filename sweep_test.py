@@ -0,0 +1,57 @@
+"""
+Tests parameter sweeps and their cell cache
+"""
+from analytics.bandit.environment import Scenario
+from analytics.bandit.sweep import Sweep, expand_grid, read_columns
+import os
+import shutil
+import tempfile
+
+SCENARIO = Scenario('binomial', ps=[.1, .2], drift=[.05, 0.])
+CYCLES = 3
+GRID = {'bandit': ['bayesian', 'epsilon'], 'env.sliding_window': [None, 2]}
+
+
+def test_expand_grid():
+    configs = expand_grid(GRID)
+    assert len(configs) == 4
+    assert dict(bandit='epsilon', **{'env.sliding_window': 2}) in configs
+
+
+def test_run():
+    directory = tempfile.mkdtemp()
+    try:
+        sweep = Sweep(GRID, SCENARIO, os.path.join(directory, 'cache'), cycles=CYCLES, batch=100,
+                      replications=2, processes=1)
+        path = os.path.join(directory, 'sweep.npz')
+        results = sweep.run(path)
+        assert len(os.listdir(sweep.cache_directory)) == 8
+        assert len(results) == 4 * CYCLES
+        assert (results.replications == 2).all()
+        assert (results.regret >= 0).all()
+        # the first equal allocation loses .1 on the 50 pulls of the worse arm
+        assert (abs(results[results.cycle == 0].regret - 5.) < 1e-9).all()
+
+        cache_times = [os.path.getmtime(os.path.join(sweep.cache_directory, name))
+                       for name in sorted(os.listdir(sweep.cache_directory))]
+        rerun = Sweep(GRID, Scenario('binomial', ps=[.1, .2], drift=[.05, 0.]),
+                      sweep.cache_directory, cycles=CYCLES, batch=100, replications=2).run()
+        assert cache_times == [os.path.getmtime(os.path.join(sweep.cache_directory, name))
+                               for name in sorted(os.listdir(sweep.cache_directory))]
+        assert rerun.equals(results)
+
+        saved = read_columns(path)
+        assert list(saved.columns) == list(results.columns)
+        assert (saved.bandit == results.bandit).all()
+        assert (saved.regret == results.regret).all()
+        assert list(read_columns(path, ['cycle', 'regret']).columns) == ['cycle', 'regret']
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'
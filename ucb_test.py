@@ -0,0 +1,41 @@
+"""
+Tests the upper confidence bound policies
+"""
+from analytics.bandit.arm import NormalArm
+from analytics.bandit.arm_stats import ArmState, summarize
+from analytics.bandit.bandit import KLUCBBandit
+from datetime import date
+import numpy as np
+
+RUN_DATE = date(2017, 4, 1)
+
+
+def new_states(rewards):
+    states = []
+    for values in rewards:
+        state = ArmState(summarize([]))
+        state.add(RUN_DATE, summarize(values))
+        states.append(state)
+    return states
+
+
+def test_gaussian_single_reward():
+    bandit = KLUCBBandit(kind='gaussian')
+    states = new_states([[1.], np.random.normal(1.5, 1., 100)])
+    allocation = bandit.select_arm(2, NormalArm(), states, None, RUN_DATE, RUN_DATE, None, 10)
+    assert (allocation == 0).all()
+
+
+def test_pooled_sigma():
+    bandit = KLUCBBandit(kind='gaussian')
+    counts, ssd = np.array([1., 3., 5.]), np.array([0., 2., 4.])
+    assert np.isclose(bandit.pooled_sigma(counts, ssd), 1.)
+    assert bandit.pooled_sigma(np.array([1., 1.]), np.zeros(2)) == KLUCBBandit.DEFAULT_SIGMA
+
+
+if __name__ == '__main__':
+
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print name, 'passed'